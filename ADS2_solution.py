@@ -10,9 +10,34 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
+import functools
+import glob
+import hashlib
+import json
+import argparse
+import io
+import os
+import re
+import threading
+import time
+import tracemalloc
 import warnings
 
-from scipy.stats import skew, kurtosis
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.patches import Patch
+
+# pyarrow is only needed for the on-disk cache of the cleaned dataframes
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
 
 
 # =============================================================================
@@ -20,106 +45,842 @@ from scipy.stats import skew, kurtosis
 # =============================================================================
 
 
+# file with the catalog of the indicators used in the analysis
+CATALOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "indicators.json")
+
+# default first and last year kept for the analysis
+FIRST_YEAR = 1990
+LAST_YEAR = 2019
+
+# number of csv rows parsed at a time
+CHUNK_SIZE = 20000
+
+
+# folder used to keep the cached climate dataframes
+CACHE_DIR = ".climate_cache"
+
+
+# trace of the running stages, None while tracing is disabled
+_trace = None
+
+
+# class to record the stages of a run
+class StageTrace:
+    """
+    This class records the wall time, cpu time, rows processed and memory
+    allocated by each traced stage. The events are written by write as
+    json lines, or as a Chrome trace (format "chrome") which can be opened
+    in chrome://tracing or Perfetto. Memory is traced with tracemalloc,
+    which slows the run down; set memory to False to skip it.
+    """
+
+    def __init__(self, filename, format="jsonl", memory=True):
+
+        # keep the output and the options
+        self.filename = filename
+        self.format = format
+        self.memory = memory
+
+        # start the clock and the memory tracing
+        self.events = []
+        self.start = time.perf_counter()
+        self._local = threading.local()
+        self._started = memory and not tracemalloc.is_tracing()
+        if self._started:
+            tracemalloc.start()
+
+    def begin(self):
+        """
+        This method starts a stage and returns its frame
+        """
+
+        # keep the stages running in this thread
+        frames = self._local.__dict__.setdefault("frames", [])
+
+        # start the memory of the stage from the current allocations
+        current = peak = 0
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if frames:
+                frames[-1]["peak"] = max(frames[-1]["peak"], peak)
+            tracemalloc.reset_peak()
+
+        # start the clocks of the stage
+        frame = {"memory": current, "peak": 0, "depth": len(frames),
+                 "wall": time.perf_counter(), "cpu": time.thread_time()}
+        frames.append(frame)
+        return frame
+
+    def end(self, frame, name, rows=None):
+        """
+        This method ends the stage started with frame and records its event
+        """
+
+        # stop the clocks of the stage
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        self._local.frames.remove(frame)
+
+        # find the memory allocated by the stage and its peak
+        current = peak = frame["memory"]
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, frame["peak"])
+            if self._local.frames:
+                parent = self._local.frames[-1]
+                parent["peak"] = max(parent["peak"], peak)
+
+        # record the event
+        self.events.append({"name": name,
+                            "start": round(frame["wall"] - self.start, 6),
+                            "wall_seconds": round(wall - frame["wall"], 6),
+                            "cpu_seconds": round(cpu - frame["cpu"], 6),
+                            "rows": rows,
+                            "memory_bytes": current - frame["memory"],
+                            "peak_bytes": peak - frame["memory"],
+                            "depth": frame["depth"],
+                            "thread": threading.get_ident()})
+
+    def write(self):
+        """
+        This method writes the recorded events into the trace file
+        """
+
+        # write one json line per event
+        if self.format == "jsonl":
+            with open(self.filename, "w") as trace_file:
+                for event in self.events:
+                    trace_file.write(json.dumps(event) + "\n")
+            return
+
+        # convert the events to complete events of the Chrome trace format
+        events = [{"name": e["name"], "cat": "stage", "ph": "X",
+                   "ts": e["start"] * 1e6, "dur": e["wall_seconds"] * 1e6,
+                   "pid": os.getpid(), "tid": e["thread"],
+                   "args": {k: e[k] for k in ("cpu_seconds", "rows",
+                                              "memory_bytes", "peak_bytes")}}
+                  for e in self.events]
+        with open(self.filename, "w") as trace_file:
+            json.dump({"traceEvents": events}, trace_file)
+
+
+# function to start tracing the stages
+def start_trace(filename, format=None, memory=True):
+    """
+    This function starts recording the traced stages into filename. The
+    format is "chrome" for a .json file and "jsonl" otherwise, unless it
+    is given. Stages run in worker processes are not recorded.
+    """
+
+    # choose the format from the file extension
+    global _trace
+    if format is None:
+        format = "chrome" if filename.endswith(".json") else "jsonl"
+
+    # start the trace
+    _trace = StageTrace(filename, format, memory)
+    return _trace
+
+
+# function to stop tracing the stages
+def stop_trace():
+    """
+    This function stops the trace, writes its file and returns the recorded
+    events, or None when no trace was started
+    """
+
+    # stop when nothing was traced
+    global _trace
+    trace, _trace = _trace, None
+    if trace is None:
+        return None
+
+    # stop the memory tracing and write the file
+    if trace._started:
+        tracemalloc.stop()
+    trace.write()
+
+    # return the events
+    return trace.events
+
+
+# class to trace a block of code as one stage
+class TraceStage:
+    """
+    This class is a context manager which records the block it wraps as
+    one stage of the trace. The number of rows processed can be set on the
+    stage inside the block. Nothing is recorded while tracing is disabled.
+    """
+
+    def __init__(self, name, rows=None):
+
+        # keep the name and the rows of the stage
+        self.name = name
+        self.rows = rows
+        self._trace = None
+
+    def __enter__(self):
+
+        # start the stage when tracing
+        self._trace = _trace
+        if self._trace is not None:
+            self._frame = self._trace.begin()
+        return self
+
+    def __exit__(self, *exc_info):
+
+        # record the stage when it was started
+        if self._trace is not None:
+            self._trace.end(self._frame, self.name, self.rows)
+            self._trace = None
+        return False
+
+
+# function to count the rows processed by a traced function
+def _count_rows(args, result):
+    """
+    This function returns the number of rows of the first dataframe or
+    array among the arguments and the result, or None
+    """
+
+    # find the first value with rows
+    for value in args + (result,):
+        shape = getattr(value, "shape", None)
+        if shape:
+            return shape[0]
+    return None
+
+
+# decorator to trace every call of a function as one stage
+def traced(function):
+    """
+    This decorator records every call of the function as one stage of the
+    trace, named after the function. While tracing is disabled the
+    function is called directly.
+    """
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+
+        # call the function directly when not tracing
+        trace = _trace
+        if trace is None:
+            return function(*args, **kwargs)
+
+        # call the function inside a stage
+        frame = trace.begin()
+        rows = None
+        try:
+            result = function(*args, **kwargs)
+            rows = _count_rows(args, result)
+            return result
+        finally:
+            trace.end(frame, function.__qualname__, rows)
+
+    # return the traced function
+    return wrapper
+
+
+# function to read the catalog of the indicators
+def load_indicator_catalog(filename=CATALOG_FILE):
+    """
+    This function reads the indicator catalog, a json file which maps
+    each World Bank indicator code to its short name, unit and first and
+    last year, and returns it as a dictionary. Missing years default to
+    FIRST_YEAR and LAST_YEAR.
+    """
+
+    # read the catalog
+    with open(filename) as catalog_file:
+        catalog = json.load(catalog_file)
+
+    # fill the default years
+    for entry in catalog.values():
+        entry.setdefault("unit", "")
+        entry.setdefault("first_year", FIRST_YEAR)
+        entry.setdefault("last_year", LAST_YEAR)
+
+    # return the catalog
+    return catalog
+
+
+# function to build the cache key of a climate data file
+def climate_cache_key(filename, catalog, fill=None):
+    """
+    This function get the file name, the indicator catalog and the gap
+    filling as arguments and returns a key built from the size and the
+    modification time of the file, the catalog and the gap filling, so the
+    key changes whenever any of them changes.
+    """
+
+    # read the size and modification time of the file
+    stat = os.stat(filename)
+
+    # collect everything the cleaned dataframes depend on
+    source = {"file": os.path.abspath(filename),
+              "size": stat.st_size,
+              "mtime": stat.st_mtime_ns,
+              "catalog": catalog}
+    if fill is not None:
+        source["fill"] = list(fill)
+
+    # hash the description of the source
+    return hashlib.sha1(json.dumps(source, sort_keys=True).encode()
+                        ).hexdigest()[:16]
+
+
+# function to get the cache file path of a climate data file
+def climate_cache_path(filename, cache_dir, key, fill=None):
+    """
+    This function returns the cache file path of the climate table for the
+    given file and cache key. The tables with filled gaps are kept next to
+    the raw tables with a ".filled" prefix.
+    """
+
+    # use the name of the file without extension as the prefix
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    if fill is not None:
+        stem += ".filled"
+
+    # return the path of the table
+    return os.path.join(cache_dir, "{}-{}.feather".format(stem, key))
+
+
+# schema metadata key of the source file of a cached table
+CACHE_SOURCE_KEY = b"climate_source"
+
+
+# function to list the cache files of a climate data file
+def climate_cache_files(filename, cache_dir, fill=None):
+    """
+    This function returns the cache files of every version of the given
+    file, with filled gaps when fill is given. Only the files named after
+    the file with a cache key, and whose metadata records the same source
+    path, are kept, so the caches of other files with a similar name or
+    with the same name in another folder are left alone.
+    """
+
+    # find the files named after the file and a key of 16 hex digits
+    pattern = re.escape(os.path.basename(
+        climate_cache_path(filename, cache_dir, "KEY", fill))).replace(
+            "KEY", "[0-9a-f]{16}")
+    paths = [path for path in glob.glob(os.path.join(glob.escape(cache_dir),
+                                                     "*.feather"))
+             if re.fullmatch(pattern, os.path.basename(path))]
+
+    # keep the files written from the same source file
+    source = os.path.abspath(filename).encode()
+    return [path for path in paths
+            if _cache_metadata(path).get(CACHE_SOURCE_KEY) == source]
+
+
+# function to read the schema metadata of a cache file
+def _cache_metadata(path):
+    """ Return the schema metadata of a cache file, empty if unreadable """
+
+    # read only the schema and close the file at once
+    try:
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return {}
+
+
+# function to read the climate table from the cache
+@traced
+def read_climate_cache(filename, catalog, cache_dir=CACHE_DIR, fill=None):
+    """
+    This function returns the cached climate table of the given file,
+    indicator catalog and gap filling, or None when there is no valid
+    cache. The cache file is memory mapped instead of parsing the csv file
+    again, and the year and value columns of the table are read-only views
+    of the mapped file (see read_cache_table).
+    """
+
+    # the cache can not be used without pyarrow
+    if feather is None:
+        return None
+
+    # find the cache file of the current version of the file
+    path = climate_cache_path(filename, cache_dir,
+                              climate_cache_key(filename, catalog, fill),
+                              fill)
+    if not os.path.exists(path):
+        return None
+
+    # memory map the cached table
+    return read_cache_table(path)
+
+
+# function to read a cache file without copying its columns
+def read_cache_table(path):
+    """
+    This function memory maps a cache file and returns its table. The
+    blocks of the columns are not consolidated, so the numeric columns
+    stay views of the mapped file instead of being copied; only the small
+    categories of the name columns are built in memory.
+    """
+
+    # memory map the table and keep one block per column
+    return feather.read_table(path, memory_map=True).to_pandas(
+        split_blocks=True)
+
+
+# function to write the climate table into the cache
+@traced
+def write_climate_cache(filename, catalog, df_climate, cache_dir=CACHE_DIR,
+                        fill=None):
+    """
+    This function stores the climate table of the given file, indicator
+    catalog and gap filling in the cache as an uncompressed feather file
+    and removes the cache files of older versions of the file.
+    """
+
+    # the cache can not be used without pyarrow
+    if feather is None:
+        return
+
+    # create the cache folder
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # get the cache file of the current version of the file
+    path = climate_cache_path(filename, cache_dir,
+                              climate_cache_key(filename, catalog, fill),
+                              fill)
+
+    # remove the stale cache files of the same file
+    for stale in climate_cache_files(filename, cache_dir, fill):
+        if stale != path:
+            os.remove(stale)
+
+    # keep the missing values as NaN instead of nulls and write every
+    # column in one chunk, so the columns can be read without a copy
+    table = pa.Table.from_pandas(df_climate)
+    for name in df_climate.select_dtypes("float").columns:
+        table = table.set_column(
+            table.schema.get_field_index(name), name,
+            pa.array(df_climate[name].to_numpy(), from_pandas=False))
+
+    # record the source file, checked before a cache file is removed
+    metadata = dict(table.schema.metadata or {})
+    metadata[CACHE_SOURCE_KEY] = os.path.abspath(filename).encode()
+    table = table.replace_schema_metadata(metadata)
+
+    # write the table into a temporary file and move it into place
+    temp_path = path + ".tmp"
+    feather.write_feather(table, temp_path, compression="uncompressed",
+                          chunksize=max(len(table), 1))
+    os.replace(temp_path, path)
+
+
+# function to read the latest cached table of a file
+def read_previous_climate_cache(filename, cache_dir=CACHE_DIR, fill=None):
+    """
+    This function returns the most recent cached climate table of the
+    given file whatever its version, with filled gaps when fill is given,
+    or None when there is none. It gives the previous version of the data
+    when the file has been replaced.
+    """
+
+    # the cache can not be used without pyarrow
+    if feather is None:
+        return None
+
+    # find the newest cache file of the file
+    paths = climate_cache_files(filename, cache_dir, fill)
+    if not paths:
+        return None
+    path = max(paths, key=os.path.getmtime)
+
+    # memory map the cached table
+    return read_cache_table(path)
+
+
+# function to turn the wide indicator rows into the long climate table
+@traced
+def tidy_climate_data(df_wide):
+    """
+    This function get a dataframe with one row per country and indicator
+    and one column per year, and returns the climate table: one row per
+    country, indicator and year, sorted in that order, with categorical
+    country and indicator columns, an int16 year and float64 values. Every
+    country has a row for every indicator and year, missing data is NaN,
+    so the values reshape into a country x indicator x year array.
+    """
+
+    # find the year columns
+    year_cols = [c for c in df_wide.columns if str(c).isdigit()]
+
+    # keep the countries and indicators in the order of the file
+    countries = pd.unique(df_wide["Country Name"])
+    indicators = pd.unique(df_wide["Indicator Name"])
+    codes = df_wide.groupby("Country Name", sort=False)["Country Code"].first()
+
+    # place every row on the full grid of countries and indicators
+    grid = pd.MultiIndex.from_product([countries, indicators])
+    values = df_wide.set_index(["Country Name", "Indicator Name"])[
+        year_cols].reindex(grid).to_numpy(dtype="float64")
+
+    # find the country and indicator of each value
+    n_countries, n_indicators, n_years = (len(countries), len(indicators),
+                                          len(year_cols))
+    country_codes = np.repeat(np.arange(n_countries), n_indicators * n_years)
+    indicator_codes = np.tile(np.repeat(np.arange(n_indicators), n_years),
+                              n_countries)
+
+    # create the climate table
+    return pd.DataFrame({
+        "Country Name": pd.Categorical.from_codes(country_codes, countries),
+        "Country Code": pd.Categorical.from_codes(
+            country_codes, codes.loc[countries].to_numpy()),
+        "Indicator Name": pd.Categorical.from_codes(indicator_codes,
+                                                    indicators),
+        "Year": np.tile(np.array(year_cols, dtype="int16"),
+                        n_countries * n_indicators),
+        "Total": values.ravel()})
+
+
+# function to blank the years outside the years of each indicator
+def blank_outside_years(df_years, codes, catalog):
+    """
+    This function get the year columns of the indicator rows, their
+    indicator codes and the indicator catalog and returns the year columns
+    with NaN outside the first and last year of each indicator. Indicators
+    missing from the catalog keep FIRST_YEAR to LAST_YEAR.
+    """
+
+    # find the first and last year of each row
+    years = df_years.columns.astype("int64").to_numpy()
+    first = codes.map({k: v["first_year"] for k, v in catalog.items()})
+    last = codes.map({k: v["last_year"] for k, v in catalog.items()})
+    first = first.fillna(FIRST_YEAR).to_numpy(dtype="int64")
+    last = last.fillna(LAST_YEAR).to_numpy(dtype="int64")
+
+    # blank the years outside them
+    outside = ((years < first[:, np.newaxis]) |
+               (years > last[:, np.newaxis]))
+    return df_years.mask(outside)
+
+
 # create function for read file
-def read_climate_data(filename):
+@traced
+def read_climate_data(filename, chunksize=CHUNK_SIZE, cache_dir=CACHE_DIR,
+                      catalog=None, fill=None):
     """
     This function reads climate change data file included in World
-    Bank climate data and returns two dataframes:
-    one with years as columns and one with countries as columns.
+    Bank climate data and returns the climate table with one row per
+    country, indicator and year (see tidy_climate_data).
+    The indicators, their short names and years come from the indicator
+    catalog, by default the one in indicators.json.
+    The file is parsed in chunks, only the required columns are read and
+    only the rows of the catalog indicators are kept from each chunk.
+    The table is cached in cache_dir and read from there while the file
+    and the catalog are unchanged. Set cache_dir to None to skip the cache.
+    With fill, a (method, max_gap) pair, the gaps of the series are filled
+    by fill_climate_gaps and the filled table is cached next to the raw
+    one.
     """
 
-    # read data from csv
-    df_data = pd.read_csv(filename, skiprows=4)
+    # read the default catalog
+    if catalog is None:
+        catalog = load_indicator_catalog()
+
+    # use the cached table when the file has not changed
+    if cache_dir is not None:
+        cached = read_climate_cache(filename, catalog, cache_dir, fill)
+        if cached is not None:
+            return cached
+
+    # fill the gaps of the raw table and cache the result next to it
+    if fill is not None:
+        df_climate = fill_climate_gaps(
+            read_climate_data(filename, chunksize, cache_dir, catalog),
+            *fill)
+        if cache_dir is not None:
+            write_climate_cache(filename, catalog, df_climate, cache_dir,
+                                fill)
+        return df_climate
+
+    # read only the header to find the year columns in the file
+    header = pd.read_csv(filename, skiprows=4, nrows=0).columns
+
+    # keep the years of any indicator by their labels
+    first_year = min(entry["first_year"] for entry in catalog.values())
+    last_year = max(entry["last_year"] for entry in catalog.values())
+    year_cols = [c for c in header
+                 if c.isdigit() and first_year <= int(c) <= last_year]
+
+    # set the columns to read and their data types
+    id_cols = ["Country Name", "Country Code", "Indicator Code"]
+    dtypes = dict.fromkeys(id_cols, str)
+    dtypes.update(dict.fromkeys(year_cols, "float64"))
+
+    # parse the csv as one traced stage
+    with TraceStage("parse csv") as stage:
+
+        # read data from csv chunk by chunk
+        reader = pd.read_csv(filename,
+                             skiprows=4,
+                             usecols=id_cols + year_cols,
+                             dtype=dtypes,
+                             chunksize=chunksize)
+
+        # filter the catalog indicators from each chunk by their codes
+        chunks = []
+        stage.rows = 0
+        for chunk in reader:
+            stage.rows += len(chunk)
+            chunks.append(chunk[chunk["Indicator Code"].isin(catalog.keys())])
+
+        # create a new dataframe from the filtered chunks
+        df_climate_change = pd.concat(chunks, ignore_index=True)
+
+    # blank the years outside the years of each indicator
+    codes = df_climate_change["Indicator Code"]
+    df_climate_change[year_cols] = blank_outside_years(
+        df_climate_change[year_cols], codes, catalog)
+
+    # name the indicators with their short names
+    df_climate_change["Indicator Name"] = codes.map(
+        {k: v["name"] for k, v in catalog.items()})
+
+    # create the long climate table
+    df_climate = tidy_climate_data(df_climate_change)
+
+    # store the table for the next runs
+    if cache_dir is not None:
+        write_climate_cache(filename, catalog, df_climate, cache_dir)
+
+    # return the climate table
+    return df_climate
+
+
+# function to find the cells that changed between two climate tables
+def diff_climate_tables(df_old, df_new):
+    """
+    This function get an old and a new climate table as arguments and
+    returns the rows of the new table whose value is new or different,
+    with the old value in a "Previous" column. Missing values on both
+    sides are equal. Series removed from the new table are not reported.
+    """
 
-    # create a new dataframe to filter five usefull indicators
-    df_climate_change = df_data[
-        (df_data["Indicator Name"] == "Urban population") |
-        (df_data["Indicator Name"] == "Forest area (% of land area)") |
-        (df_data["Indicator Name"] == "CO2 emissions (metric tons per capita)") |
-        (df_data["Indicator Name"] == "Arable land (% of land area)") |
-        (df_data["Indicator Name"] ==
-         "Renewable energy consumption (% of total final energy consumption)")
-    ].reset_index(drop=True)
+    # compare the values directly when both tables have the same grid
+    same_grid = (len(df_old) == len(df_new) and all(
+        df_old[col].cat.categories.equals(df_new[col].cat.categories)
+        for col in ("Country Name", "Indicator Name")) and np.array_equal(
+        df_old["Year"].to_numpy(), df_new["Year"].to_numpy()))
+    if same_grid:
+        previous = df_old["Total"].to_numpy()
+
+    # otherwise match the old values on country, indicator and year
+    else:
+        keys = ["Country Name", "Indicator Name", "Year"]
+        old = pd.Series(df_old["Total"].to_numpy(),
+                        index=pd.MultiIndex.from_frame(
+                            df_old[keys].astype({"Country Name": str,
+                                                 "Indicator Name": str})))
+        new_index = pd.MultiIndex.from_frame(
+            df_new[keys].astype({"Country Name": str,
+                                 "Indicator Name": str}))
+        previous = old.reindex(new_index).to_numpy()
+
+    # find the changed cells
+    current = df_new["Total"].to_numpy()
+    changed = ~((previous == current) |
+                (np.isnan(previous) & np.isnan(current)))
+
+    # return the changed rows with their old values
+    df_delta = df_new[changed].copy()
+    df_delta["Previous"] = previous[changed]
+    return df_delta
+
+
+# function to get the climate table as a 3-D array
+def climate_cube(df_climate):
+    """
+    This function get the climate table as an argument and returns its
+    values as a country x indicator x year array, which is a reshape of the
+    table without copying, together with the countries, indicators and
+    years of the axes
+    """
 
-    df_climate_change["Indicator Name"] = df_climate_change["Indicator Name"].replace(
-        ["Urban population",
-         "Forest area (% of land area)",
-         "CO2 emissions (metric tons per capita)",
-         "Arable land (% of land area)",
-         "Renewable energy consumption (% of total final energy consumption)"],
-        ["Urban population",
-         "Forest area(%)",
-         "CO2 emissions(mt)",
-         "Arable land(%)",
-         "Renew. energy consump(%)"])
+    # find the axes of the array
+    countries = list(df_climate["Country Name"].cat.categories)
+    indicators = list(df_climate["Indicator Name"].cat.categories)
+    n_years = len(df_climate) // max(len(countries) * len(indicators), 1)
+    years = df_climate["Year"].to_numpy()[:n_years]
 
-    # drop all unnecessary columns
-    df_climate_change = df_climate_change.drop(["Indicator Code",
-                                                "Unnamed: 66",
-                                                "2020",
-                                                "2021"], axis=1)
+    # reshape the values
+    cube = df_climate["Total"].to_numpy().reshape(len(countries),
+                                                  len(indicators),
+                                                  n_years)
 
-    # drop the years between 1960 to 1990
-    df_climate_change = df_climate_change.drop(df_climate_change.iloc[:, 3:33],
-                                               axis=1)
+    # return the array and its axes
+    return cube, countries, indicators, years
 
-    # create a dataframe to get years as columns
-    df_year = df_climate_change.copy()
 
-    # remove all NaNs to clean the dataframe
-    df_year = df_climate_change.dropna(axis=0)
+# longest run of missing years filled by default
+MAX_GAP = 3
 
-    # set the country name as index
-    df_climate_change = df_climate_change.set_index("Country Name")
 
-    # transpose the dataframe to get countries as columns
-    df_country = df_climate_change.transpose()
+# function to fill the gaps of many series at once
+def fill_gaps(values, method="linear", max_gap=MAX_GAP):
+    """
+    This function get an array of series with years on the last axis and
+    returns a copy with the gaps filled, for all series at once. With
+    method "linear" the runs of at most max_gap missing years between two
+    years with data are interpolated linearly, and the years before the
+    first or after the last value stay missing. With method "forward" the
+    first max_gap missing years after each value repeat that value.
+    Set max_gap to None to fill every gap.
+    """
 
-    # clean the transposed dataframe
-    df_country = df_country.dropna(axis=1)
+    # find the last and the next year with data at each year
+    values = np.asarray(values, dtype="float64")
+    valid = ~np.isnan(values)
+    n_years = values.shape[-1]
+    years = np.arange(n_years)
+    previous = np.maximum.accumulate(np.where(valid, years, -1), axis=-1)
+    following = np.flip(np.minimum.accumulate(
+        np.flip(np.where(valid, years, n_years), axis=-1), axis=-1), axis=-1)
+    if max_gap is None:
+        max_gap = n_years
+
+    # get the values of those years
+    before = np.take_along_axis(values, np.maximum(previous, 0), axis=-1)
+    after = np.take_along_axis(values, np.minimum(following, n_years - 1),
+                               axis=-1)
+
+    # interpolate the short gaps between two values
+    if method == "linear":
+        fill = (~valid & (previous >= 0) & (following < n_years) &
+                (following - previous - 1 <= max_gap))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            filled = before + ((years - previous) / (following - previous) *
+                               (after - before))
+
+    # repeat the last value over the first missing years
+    elif method == "forward":
+        fill = ~valid & (previous >= 0) & (years - previous <= max_gap)
+        filled = before
+    else:
+        raise ValueError("method must be 'linear' or 'forward'")
+
+    # return the filled series
+    return np.where(fill, filled, values)
+
+
+# function to fill the gaps of the climate table
+@traced
+def fill_climate_gaps(df_climate, method="linear", max_gap=MAX_GAP):
+    """
+    This function get the climate table as an argument and returns a copy
+    with the gaps of every country and indicator filled by fill_gaps, in
+    one operation on the country x indicator x year array, so that fewer
+    series are dropped as incomplete
+    """
 
-    # return both year and country dataframes
-    return df_year, df_country
+    # fill the array of the table
+    cube = climate_cube(df_climate)[0]
 
+    # return the table with the filled values
+    return df_climate.assign(
+        Total=fill_gaps(cube, method, max_gap).reshape(-1))
 
-# function to extract data for specific countries
-def extract_country_data(country_name):
+
+# function to get the data of one country from the climate table
+def country_view(df_climate, country_name):
+    """
+    This function get the climate table and the country name as arguments
+    and returns a dataframe with years as index and indicators as columns,
+    which shares its values with the table
+    """
+
+    # get the country x indicator x year array
+    cube, countries, indicators, years = climate_cube(df_climate)
+
+    # take the slice of the country without copying
+    df_state = pd.DataFrame(cube[countries.index(country_name)].T,
+                            index=pd.Index(years, name="Year"),
+                            columns=pd.Index(indicators,
+                                             name="Indicator Name"),
+                            copy=False)
+
+    # return the dataframe
+    return df_state
+
+
+# function to get the data of one indicator from the climate table
+def indicator_view(df_climate, indicator_name):
     """
-    This function get the country name as an argument and create a new
-    dataframe with data of given country
+    This function get the climate table and the indicator name as arguments
+    and returns a dataframe with years as index and countries as columns,
+    which shares its values with the table
     """
 
-    # extract the given country data
-    df_state = df_country[country_name]
+    # get the country x indicator x year array
+    cube, countries, indicators, years = climate_cube(df_climate)
 
-    # use iloc to extract columns for new df
-    df_cols = df_state.iloc[1]
+    # take the slice of the indicator without copying
+    df_indicator = pd.DataFrame(cube[:, indicators.index(indicator_name)].T,
+                                index=pd.Index(years, name="Year"),
+                                columns=pd.Index(countries,
+                                                 name="Country Name"),
+                                copy=False)
 
-    # take the data less the header row
-    df_state = df_state[2:]
+    # return the dataframe
+    return df_indicator
 
-    # assign new columns to the df
-    df_state.columns = df_cols
 
-    # convert data types to numeric
-    df_state = df_state.apply(pd.to_numeric, errors="coerce")
+# function to extract data for specific countries
+@traced
+def extract_country_data(df_climate, country_name):
+    """
+    This function get the climate table and the country name as arguments
+    and create a new dataframe with data of given country, keeping only the
+    indicators without missing years
+    """
+
+    # extract the given country data and drop incomplete indicators
+    df_state = country_view(df_climate, country_name).dropna(axis=1)
 
     # return the dataframe
     return df_state
 
 
+# countries compared by the statistics of each indicator
+STATISTICS_COUNTRIES = ["Brazil", "China", "Germany", "India",
+                        "United States"]
+
+
 # function to compare statistical properties of each indicators per state
-def individual_country_statisctic(country_name):
+@traced
+def individual_country_statisctic(df_climate, country_name):
     """
-    This function get the country name as an argument and produce the
-    comparison of the statistical properties of indicators for given country
+    This function get the climate table and the country name as
+    arguments and returns the summary statistics of each indicator for
+    given country, with one column per indicator. See
+    format_country_statistics to print them.
     """
 
     # call thefunction to create country dataframe
-    df_state = extract_country_data(country_name)
+    df_state = extract_country_data(df_climate, country_name)
 
-    # extract statistical properties
-    df_describe = df_state.describe().round(2)
+    # return the statistical properties
+    return describe_frame(df_state)
+
+
+# function to format the statistics of a country for the console
+def format_country_statistics(df_describe, country_name):
+    """
+    This function get the statistics of individual_country_statisctic and
+    the country name as arguments and returns them as text, rounded and
+    with each column name split into two lines to fit the console
+    """
+
+    # round the statistics
+    df_describe = df_describe.round(2)
 
     # extract column headers
     cols = df_describe.columns
@@ -134,428 +895,1970 @@ def individual_country_statisctic(country_name):
         lencols)
     ))
 
-    # print the statistics
-    print("========== The summary statistics for", country_name, "===========")
-    print("\n")
-    print(df_describe)
-    print("==================================================================")
-    print("\n")
-
-    # return the statistics for each country
-    return
+    # return the text of the statistics
+    return ("========== The summary statistics for " + country_name +
+            " ===========\n\n\n" + str(df_describe) + "\n" + "=" * 66 +
+            "\n\n")
 
 
 # function to compare statistical properties of each countries per indicator
-def individual_indicator_statistics(indicator_name):
+@traced
+def individual_indicator_statistics(store, indicator_name,
+                                    countries=STATISTICS_COUNTRIES):
     """
-    This function get the indicator name as an argument and produce the
-    comparison of the statistical properties of countries for given indicator
+    This function get the climate store, the indicator name and the
+    countries as arguments and returns the summary statistics of each
+    country for given indicator, with one column per country. See
+    format_indicator_statistics to print them.
     """
 
-    # extract given indicatordata
-    df_indicator = df_year[df_year["Indicator Name"] == indicator_name]
+    # extract given indicator data of the useful countries
+    df_indicator = store.indicator_frame(indicator_name, countries)
 
-    # drop unneccesary columns
-    df_indicator = df_indicator.drop(["Country Code", "Indicator Name"],
-                                     axis=1)
+    # return the statistical properties
+    return describe_frame(df_indicator)
 
-    # extract the useful countries for further analysis
-    df_indicator = df_indicator[
-        (df_indicator["Country Name"] == "Brazil") |
-        (df_indicator["Country Name"] == "China") |
-        (df_indicator["Country Name"] == "Germany") |
-        (df_indicator["Country Name"] == "India") |
-        (df_indicator["Country Name"] == "United States")
-    ].reset_index(drop=True)
 
-    # set the country name as index
-    df_indicator = df_indicator.set_index("Country Name")
+# function to format the statistics of an indicator for the console
+def format_indicator_statistics(df_describe, indicator_name):
+    """
+    This function get the statistics of individual_indicator_statistics and
+    the indicator name as arguments and returns them as rounded text
+    """
 
-    # transpose the df
-    df_indicator = df_indicator.T
+    # return the text of the rounded statistics
+    return ("========= The summary statistics for " + indicator_name +
+            " ==========\n\n\n" + str(df_describe.round(2)) + "\n" +
+            "=" * 66 + "\n\n")
 
-    # extract statistical properties
-    df_describe = df_indicator.describe().round(2)
 
-    # print the statistics
-    print("========= The summary statistics for", indicator_name, "==========")
-    print("\n")
-    print(df_describe)
-    print("==================================================================")
-    print("\n")
+# function to find the central sums of many series
+def central_sums(values):
+    """
+    This function get an array of series with years on the last axis and
+    returns, for every series, the number of years with data, the mean,
+    the sums of the second, third and fourth powers of the deviations from
+    the mean, the minimum and the maximum. Missing years are ignored.
+    """
 
-    # return the statistics for each country
-    return
+    # count the years with data of each series
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=-1)
+
+    # ignore the series without data
+    with np.errstate(divide="ignore", invalid="ignore"):
+
+        # find the mean of each series
+        mean = np.where(valid, values, 0).sum(axis=-1) / count
+
+        # find the sums of the powers of the deviations
+        dev = np.where(valid, values - mean[..., np.newaxis], 0)
+        m2 = (dev ** 2).sum(axis=-1)
+        m3 = (dev ** 3).sum(axis=-1)
+        m4 = (dev ** 4).sum(axis=-1)
+
+    # find the smallest and largest value of each series
+    minimum = np.where(count > 0, np.where(valid, values, np.inf).min(
+        axis=-1, initial=np.inf), np.nan)
+    maximum = np.where(count > 0, np.where(valid, values, -np.inf).max(
+        axis=-1, initial=-np.inf), np.nan)
+
+    # return the sums
+    return count, mean, m2, m3, m4, minimum, maximum
+
+
+# function to turn the central sums into a dataframe of moments
+def moments_frame(index, count, mean, m2, m3, m4):
+    """
+    This function get the index and the central sums of the series (see
+    central_sums) and returns the dataframe with their count, mean,
+    variance, skewness and excess kurtosis, keeping only the series with
+    data
+    """
+
+    # ignore the divisions of series without data or variation
+    with np.errstate(divide="ignore", invalid="ignore"):
+
+        # find the central moments of each series
+        m2, m3, m4 = m2 / count, m3 / count, m4 / count
+
+        # find the skewness and the excess kurtosis
+        skewness = np.where(m2 > 0, m3 / m2 ** 1.5, np.nan)
+        kurt = np.where(m2 > 0, m4 / m2 ** 2 - 3, np.nan)
+
+    # create one row for each series
+    df_moments = pd.DataFrame({"Count": count,
+                               "Mean": mean,
+                               "Variance": m2,
+                               "Skewness": skewness,
+                               "Kurtosis": kurt},
+                              index=index)
+
+    # keep only the series with data
+    return df_moments[df_moments["Count"] > 0]
+
+
+# number of centroids kept by the quantile sketch of each series
+SKETCH_SIZE = 64
+
+# quantiles of the summary statistics, like describe
+DESCRIBE_QUANTILES = [0.25, 0.5, 0.75]
+
+
+# function to merge the sorted centroids of many series like a t-digest
+def compress_centroids(centroids, weights, capacity):
+    """
+    This function get sorted centroids and their weights, with the series
+    on the first axis and empty centroids of weight zero last, and merges
+    adjacent centroids into fewer than capacity centroids. A centroid
+    grows only while it spans at most one unit of the t-digest scale
+    function k(q) = d * arcsin(2q - 1), so the centroids near the minimum
+    and the maximum stay small. The columns are visited once, for all
+    series together.
+    """
+
+    # find the total weight and the scale of each series
+    n_series, n_columns = weights.shape
+    rows = np.arange(n_series)
+    total = weights.sum(axis=-1)
+    scale = (capacity / 2 - 1) / np.pi
+
+    # function of the quantile scale
+    def k(q):
+        """ Return the scale of the quantiles """
+        return scale * np.arcsin(np.clip(2 * q - 1, -1, 1))
+
+    # start each series with its first centroid
+    merged = np.full((n_series, n_columns), np.nan)
+    merged_weights = np.zeros((n_series, n_columns))
+    position = np.zeros(n_series, dtype="int64")
+    before = np.zeros(n_series)
+    current_sum = np.where(weights[:, 0] > 0, centroids[:, 0], 0) * \
+        weights[:, 0]
+    current_weight = weights[:, 0].copy()
+
+    # add the next centroid to the current one or start a new one
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for j in range(1, n_columns):
+            weight = weights[:, j]
+            value = np.where(weight > 0, centroids[:, j], 0) * weight
+            grow = (weight > 0) & (
+                k((before + current_weight + weight) / total) -
+                k(before / total) <= 1)
+            start = (weight > 0) & ~grow
+
+            # store the finished centroids
+            merged[rows[start], position[start]] = (current_sum[start] /
+                                                    current_weight[start])
+            merged_weights[rows[start], position[start]] = \
+                current_weight[start]
+            position += start
+            before += np.where(start, current_weight, 0)
+
+            # update the current centroids
+            current_sum = np.where(start, value, current_sum +
+                                   np.where(grow, value, 0))
+            current_weight = np.where(start, weight, current_weight +
+                                      np.where(grow, weight, 0))
+
+        # store the last centroids
+        last = current_weight > 0
+        merged[rows[last], position[last]] = (current_sum[last] /
+                                              current_weight[last])
+        merged_weights[rows[last], position[last]] = current_weight[last]
+
+    # return the centroids up to the widest series
+    width = int((merged_weights > 0).sum(axis=-1).max(initial=0))
+    return merged[:, :width], merged_weights[:, :width]
+
+
+# class to accumulate the moments of many series in one pass
+class MomentAccumulator:
+    """
+    This class accumulates the count, mean, central sums up to the fourth
+    power, minimum and maximum of an array of series, and a quantile sketch
+    of each series, from batches of values. Batches are merged with the
+    Welford/Pebay update formulas, so partial accumulators of chunks or
+    workers merge into the same moments as one pass over all the values.
+    The sketch keeps the values of each series while it has at most
+    capacity of them, so the quantiles are exact, and is only as wide as
+    the longest series. Beyond that the values are merged into at most
+    capacity weighted centroids like a t-digest: the weight of a centroid
+    is limited by its quantile position, so the centroids stay small in
+    the tails whatever the order of the batches. Set capacity to 0 to
+    keep only the moments.
+    """
+
+    def __init__(self, shape=(), capacity=SKETCH_SIZE):
+
+        # start every series without values
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+        self.m3 = np.zeros(shape)
+        self.m4 = np.zeros(shape)
+        self.minimum = np.full(shape, np.inf)
+        self.maximum = np.full(shape, -np.inf)
+
+        # start the sketches without centroids
+        self.capacity = capacity
+        self.centroids = np.full(tuple(shape) + (0,), np.nan)
+        self.weights = np.zeros(tuple(shape) + (0,))
+
+    @classmethod
+    def concatenate(cls, accumulators, capacity=SKETCH_SIZE):
+        """ Return the accumulator of the series of 1-d accumulators """
+
+        # join the arrays of the accumulators
+        joined = cls((0,), capacity)
+        if not accumulators:
+            return joined
+        width = max(a.weights.shape[-1] for a in accumulators)
+        for name in vars(joined):
+            if name in ("centroids", "weights"):
+
+                # pad the sketches to the widest one
+                fill = np.nan if name == "centroids" else 0
+                setattr(joined, name, np.concatenate(
+                    [np.pad(getattr(a, name),
+                            [(0, 0), (0, width - a.weights.shape[-1])],
+                            constant_values=fill) for a in accumulators]))
+            elif name != "capacity":
+                setattr(joined, name, np.concatenate(
+                    [getattr(a, name) for a in accumulators]))
+        return joined
+
+    def take(self, rows):
+        """ Return the accumulator of the selected series """
+
+        # select the arrays of the series
+        selected = MomentAccumulator((0,), self.capacity)
+        for name in vars(selected):
+            if name != "capacity":
+                setattr(selected, name, getattr(self, name)[rows])
+        return selected
+
+    def update(self, values):
+        """
+        Add a batch of values with the observations on the last axis and
+        return the accumulator. Missing values are ignored.
+        """
+
+        # accumulate the batch on its own in one pass
+        batch = MomentAccumulator(self.count.shape, self.capacity)
+        values = np.asarray(values, dtype="float64")
+        (batch.count, batch.mean, batch.m2, batch.m3, batch.m4,
+         batch.minimum, batch.maximum) = central_sums(values)
+
+        # make the values of the batch its centroids, with the missing
+        # values last
+        if self.capacity:
+            batch.centroids = np.sort(values, axis=-1)
+            batch.weights = (~np.isnan(batch.centroids)).astype("float64")
+
+        # merge the batch
+        return self.merge(batch)
+
+    def merge(self, other):
+        """ Merge the values of another accumulator and return this one """
+
+        # find the counts and the difference of the means
+        n_a, n_b = self.count, other.count
+        n = n_a + n_b
+        delta = other.mean - self.mean
+
+        # combine the means and the central sums with the Pebay formulas
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = np.where(n > 0, self.mean + delta * n_b / n, 0)
+            m2 = self.m2 + other.m2 + np.where(
+                n > 0, delta ** 2 * n_a * n_b / n, 0)
+            m3 = self.m3 + other.m3 + np.where(
+                n > 0, delta ** 3 * n_a * n_b * (n_a - n_b) / n ** 2 +
+                3 * delta * (n_a * other.m2 - n_b * self.m2) / n, 0)
+            m4 = self.m4 + other.m4 + np.where(
+                n > 0, delta ** 4 * n_a * n_b * (n_a ** 2 - n_a * n_b +
+                                                 n_b ** 2) / n ** 3 +
+                6 * delta ** 2 * (n_a ** 2 * other.m2 +
+                                  n_b ** 2 * self.m2) / n ** 2 +
+                4 * delta * (n_a * other.m3 - n_b * self.m3) / n, 0)
+        self.count, self.mean = n, mean
+        self.m2, self.m3, self.m4 = m2, m3, m4
+
+        # combine the smallest and largest values
+        self.minimum = np.fmin(self.minimum, other.minimum)
+        self.maximum = np.fmax(self.maximum, other.maximum)
+
+        # join the centroids in order, with the empty ones last
+        centroids = np.concatenate((self.centroids, other.centroids), axis=-1)
+        weights = np.concatenate((self.weights, other.weights), axis=-1)
+        order = np.argsort(np.where(weights > 0, centroids, np.inf),
+                           axis=-1, kind="stable")
+        centroids = np.take_along_axis(centroids, order, axis=-1)
+        weights = np.take_along_axis(weights, order, axis=-1)
+
+        # merge the centroids of the series which do not fit any more
+        fits = (weights > 0).sum(axis=-1) <= self.capacity
+        if not fits.all():
+            merged = compress_centroids(centroids[~fits], weights[~fits],
+                                        self.capacity)
+            width = max(self.capacity, 1)
+            centroids = centroids[..., :width].copy()
+            weights = weights[..., :width].copy()
+            centroids[~fits], weights[~fits] = np.pad(
+                merged[0], [(0, 0), (0, width - merged[0].shape[-1])],
+                constant_values=np.nan), np.pad(
+                merged[1], [(0, 0), (0, width - merged[1].shape[-1])])
+
+        # keep the sketches only as wide as the longest one
+        width = int((weights > 0).sum(axis=-1).max(initial=0))
+        self.centroids = centroids[..., :width]
+        self.weights = weights[..., :width]
+
+        # return the accumulator
+        return self
+
+    def quantiles(self, q=DESCRIBE_QUANTILES):
+        """
+        Return the quantiles of each series with the quantiles on the last
+        axis, interpolated linearly between the centroids like
+        numpy.quantile. They are exact while the centroids have weight one.
+        """
+
+        # place each centroid at the middle of its values
+        weights = self.weights
+        total = weights.sum(axis=-1, keepdims=True)
+        position = np.where(weights > 0,
+                            weights.cumsum(axis=-1) - (weights + 1) / 2,
+                            np.inf)
+
+        # find the centroids on both sides of each quantile
+        target = (total - 1) * np.asarray(q)
+        n = (weights > 0).sum(axis=-1, keepdims=True)
+        below = (position[..., np.newaxis, :] <=
+                 target[..., :, np.newaxis]).sum(axis=-1) - 1
+        below = np.clip(below, 0, np.maximum(n - 2, 0))
+        above = np.minimum(below + 1, np.maximum(n - 1, 0))
+
+        # interpolate between them
+        x_0 = np.take_along_axis(position, below, axis=-1)
+        x_1 = np.take_along_axis(position, above, axis=-1)
+        y_0 = np.take_along_axis(self.centroids, below, axis=-1)
+        y_1 = np.take_along_axis(self.centroids, above, axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            fraction = np.clip(np.where(x_1 > x_0,
+                                        (target - x_0) / (x_1 - x_0), 0),
+                               0, 1)
+
+        # return the quantiles of the series with values
+        return np.where(n > 0, y_0 + fraction * (y_1 - y_0), np.nan)
+
+    def moments(self, index):
+        """
+        Return the moments of the series as a dataframe with the given
+        index, see moments_frame
+        """
+        return moments_frame(index, self.count.ravel(), self.mean.ravel(),
+                             self.m2.ravel(), self.m3.ravel(),
+                             self.m4.ravel())
+
+    def describe(self, columns, q=DESCRIBE_QUANTILES, quantiles=None):
+        """
+        Return the summary statistics of a 1-d accumulator like describe,
+        with one column per series. The quantiles come from the sketch
+        unless they are given, one row per series.
+        """
+
+        # find the sample standard deviation like pandas
+        with np.errstate(divide="ignore", invalid="ignore"):
+            std = np.where(self.count > 1,
+                           np.sqrt(self.m2 / (self.count - 1)), np.nan)
+        empty = self.count == 0
+
+        # create one row for each statistic
+        rows = {"count": self.count,
+                "mean": np.where(empty, np.nan, self.mean),
+                "std": std,
+                "min": np.where(empty, np.nan, self.minimum)}
+        if quantiles is None:
+            quantiles = self.quantiles(q)
+        for i, p in enumerate(q):
+            rows["{:g}%".format(100 * p)] = quantiles[:, i]
+        rows["max"] = np.where(empty, np.nan, self.maximum)
+
+        # return the statistics
+        return pd.DataFrame(rows, index=columns).T
+
+
+# function to summarise the columns of a dataframe
+def describe_frame(df):
+    """
+    This function get a dataframe as an argument and returns the summary
+    statistics of its columns like describe, from one MomentAccumulator
+    """
+
+    # accumulate all columns at once
+    accumulator = MomentAccumulator((df.shape[1],))
+    accumulator.update(df.to_numpy(dtype="float64").T)
+
+    # return the statistics
+    return accumulator.describe(df.columns)
+
+
+# function to compute the moments of every country and indicator at once
+@traced
+def summary_moments(df_climate, countries=None):
+    """
+    This function get the climate table as an argument and returns a
+    dataframe with the count, mean, variance, skewness and kurtosis of
+    every country and indicator, or only of the given countries. All
+    series are computed together on the 3-D array of the table and
+    missing years are ignored, so the series with gaps are kept.
+    """
+
+    # get the country x indicator x year array
+    cube, all_countries, indicators, years = climate_cube(df_climate)
+
+    # select the given countries
+    if countries is None:
+        countries = all_countries
+    else:
+        countries = [c for c in countries if c in all_countries]
+        cube = cube[[all_countries.index(c) for c in countries]]
+
+    # accumulate every series in one pass
+    accumulator = MomentAccumulator(cube.shape[:2]).update(cube)
+
+    # create one row for each country and indicator
+    index = pd.MultiIndex.from_product([countries, indicators],
+                                       names=["Country Name",
+                                              "Indicator Name"])
+
+    # return the moments of the series with data
+    return accumulator.moments(index)
+
+
+# shortest number of years on each side of a change point
+MIN_SEGMENT = 5
+
+
+# function to fit straight lines to many series from their sums
+def _line_fits(n, s_x, s_y, s_xx, s_xy, s_yy):
+    """
+    This function get the sums of the years x, the values y and their
+    products over the years of many series and returns the least squares
+    slope of each series, its sum of squared residuals and the sum of
+    squares of the values around their mean
+    """
+
+    # ignore the series without enough years or variation
+    with np.errstate(divide="ignore", invalid="ignore"):
+
+        # find the centered sums
+        v_xx = s_xx - s_x ** 2 / n
+        c_xy = s_xy - s_x * s_y / n
+        v_yy = s_yy - s_y ** 2 / n
+
+        # find the slope and the residuals
+        slope = c_xy / v_xx
+        sse = np.maximum(v_yy - c_xy * slope, 0)
+
+    # return the fits
+    return slope, sse, v_yy
+
+
+# function to compute the trends of every country and indicator at once
+@traced
+def trend_statistics(df_climate, countries=None, min_segment=MIN_SEGMENT):
+    """
+    This function get the climate table as an argument and returns a
+    dataframe with the trend of every country and indicator, or only of
+    the given countries, indexed like summary_moments:
+    Slope is the least squares slope per year and R2 its coefficient of
+    determination, CAGR the compound annual growth rate between the first
+    and last year with data, or NaN unless both values are positive.
+    The change point is the year splitting the series into two straight
+    lines, each over at least min_segment years, with the least squared
+    residuals: Change Year is the first year of the second line, Slope
+    Before and Slope After the slopes of the two lines and Change Gain the
+    share of the residuals of the single line removed by the split.
+    All series are fitted together in closed form from cumulative sums
+    over the 3-D array of the table, and missing years are ignored, so the
+    series with gaps are kept.
+    """
+
+    # get the country x indicator x year array
+    cube, all_countries, indicators, years = climate_cube(df_climate)
+
+    # select the given countries
+    if countries is None:
+        countries = all_countries
+    else:
+        countries = [c for c in countries if c in all_countries]
+        cube = cube[[all_countries.index(c) for c in countries]]
+
+    # center the years and the values of each series
+    valid = ~np.isnan(cube)
+    w = valid.astype("float64")
+    count = w.sum(axis=2)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(valid, cube, 0).sum(axis=2) / count
+    x = years - years.mean()
+    y = np.where(valid, cube - mean[..., np.newaxis], 0)
+
+    # find the running sums of each series over the years
+    zeros = np.zeros(cube.shape[:2] + (1,))
+    sums = [np.concatenate((zeros, a.cumsum(axis=2)), axis=2)
+            for a in (w, x * w, y, x * x * w, x * y, y * y)]
+    totals = [a[..., -1] for a in sums]
+
+    # fit one line to each series
+    slope, sse, sst = _line_fits(*totals)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r2 = np.where(sst > 0, 1 - sse / sst, np.nan)
+
+    # find the growth rate between the first and last years with data
+    first = valid.argmax(axis=2)
+    last = cube.shape[2] - 1 - valid[..., ::-1].argmax(axis=2)
+    start = np.take_along_axis(cube, first[..., np.newaxis], axis=2)[..., 0]
+    end = np.take_along_axis(cube, last[..., np.newaxis], axis=2)[..., 0]
+    span = years[last] - years[first]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cagr = np.where((start > 0) & (end > 0) & (span > 0),
+                        (end / start) ** (1 / span) - 1, np.nan)
+
+    # fit two lines split at every candidate year of each series
+    splits = np.arange(min_segment, cube.shape[2] - min_segment + 1)
+    before = _line_fits(*(a[..., splits] for a in sums))
+    after = _line_fits(*(t[..., np.newaxis] - a[..., splits]
+                         for t, a in zip(totals, sums)))
+    n_before = sums[0][..., splits]
+    split_sse = np.where((n_before >= min_segment) &
+                         (count[..., np.newaxis] - n_before >= min_segment),
+                         before[1] + after[1], np.inf)
+
+    # keep the split with the least residuals
+    change_year = np.full(count.shape, np.nan)
+    slope_before = np.full(count.shape, np.nan)
+    slope_after = np.full(count.shape, np.nan)
+    gain = np.full(count.shape, np.nan)
+    if len(splits):
+        best = split_sse.argmin(axis=2)[..., np.newaxis]
+        best_sse = np.take_along_axis(split_sse, best, axis=2)[..., 0]
+        found = np.isfinite(best_sse)
+        change_year = np.where(found, years[splits[best[..., 0]]], np.nan)
+        slope_before = np.where(found, np.take_along_axis(
+            before[0], best, axis=2)[..., 0], np.nan)
+        slope_after = np.where(found, np.take_along_axis(
+            after[0], best, axis=2)[..., 0], np.nan)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gain = np.where(found & (sse > 0), 1 - best_sse / sse, np.nan)
+
+    # create one row for each country and indicator
+    index = pd.MultiIndex.from_product([countries, indicators],
+                                       names=["Country Name",
+                                              "Indicator Name"])
+    df_trends = pd.DataFrame({"Slope": slope.ravel(),
+                              "R2": r2.ravel(),
+                              "CAGR": cagr.ravel(),
+                              "Change Year": change_year.ravel(),
+                              "Slope Before": slope_before.ravel(),
+                              "Slope After": slope_after.ravel(),
+                              "Change Gain": gain.ravel()},
+                             index=index)
+
+    # keep only the series with at least two years
+    return df_trends[count.ravel() >= 2]
+
+
+# indicators used for the correlation over time
+ROLLING_INDICATORS = ['Urban population',
+                      'Forest area(%)',
+                      'CO2 emissions(mt)',
+                      'Arable land(%)']
+
+
+# function to compute rolling correlations of all indicator pairs
+def rolling_correlations(values, window, min_periods=None):
+    """
+    This function get an array of series with years on the second last
+    axis and indicators on the last axis, for example countries x years x
+    indicators, and returns the correlation of every pair of indicators
+    over the window of years ending at each year. The window sums come
+    from cumulative sums, so every window costs the same whatever its
+    size. Missing values are skipped pairwise and windows with less than
+    min_periods pairs of values, by default the window size, are NaN.
+    """
+
+    # use full windows by default like pandas rolling
+    if min_periods is None:
+        min_periods = window
+
+    # center each series to keep the sums of squares small
+    values = np.asarray(values, dtype="float64")
+    valid = ~np.isnan(values)
+    count = valid.sum(axis=-2, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(valid, values, 0).sum(axis=-2, keepdims=True) / count
+    x = np.where(valid, values - mean, 0)
+
+    # pair every indicator with every other one year by year
+    pair = (valid[..., :, np.newaxis] & valid[..., np.newaxis, :])
+    pair = pair.astype("float64")
+    x_i = x[..., :, np.newaxis] * pair
+    x_j = x[..., np.newaxis, :] * pair
+
+    # function to sum each window with cumulative sums
+    def window_sum(a):
+        """ Return the sums of the windows ending at each year """
+
+        # add a zero row so the first windows can be subtracted too
+        zeros = np.zeros_like(a[..., :1, :, :])
+        total = np.concatenate((zeros, a.cumsum(axis=-3)), axis=-3)
+
+        # subtract the sum before the window from the sum at its end
+        sums = np.full_like(a, np.nan)
+        sums[..., window - 1:, :, :] = (total[..., window:, :, :] -
+                                        total[..., :-window, :, :])
+        return sums
+
+    # find the sufficient statistics of each window
+    n = window_sum(pair)
+    s_i = window_sum(x_i)
+    s_j = window_sum(x_j)
+    s_ii = window_sum(x_i * x_i)
+    s_jj = window_sum(x_j * x_j)
+    s_ij = window_sum(x_i * x_j)
+
+    # find the correlation of each window
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = s_ij - s_i * s_j / n
+        var_i = s_ii - s_i ** 2 / n
+        var_j = s_jj - s_j ** 2 / n
+        corr = cov / np.sqrt(var_i * var_j)
+
+    # drop the windows without enough data or variation
+    corr[(n < min_periods) | ~(var_i > 0) | ~(var_j > 0)] = np.nan
+
+    # return the correlations
+    return np.clip(corr, -1, 1)
+
+
+# function to get the rolling correlations of many countries
+@traced
+def rolling_correlation_frame(store, countries=None,
+                              indicators=ROLLING_INDICATORS, window_size=5):
+    """
+    This function get the climate store, countries and indicators as
+    arguments and returns the rolling correlations of every pair of
+    indicators for all countries at once, with countries and years as
+    index and the indicator pairs as columns
+    """
+
+    # get the country x indicator x year array
+    cube, all_countries, all_indicators, years = store.cube()
+
+    # use all countries when none are given
+    if countries is None:
+        countries = all_countries
+
+    # check the countries, the store has only the complete series
+    for c in countries:
+        if c not in all_countries:
+            raise KeyError(c + " has no complete series in the store")
+
+    # select the countries and indicators
+    indicators = [i for i in dict.fromkeys(indicators)
+                  if i in all_indicators]
+    c_pos = [all_countries.index(c) for c in countries]
+    i_pos = [all_indicators.index(i) for i in indicators]
+    values = cube[np.ix_(c_pos, i_pos)].transpose(0, 2, 1)
+
+    # compute the correlations of every window
+    corr = rolling_correlations(values, window_size)
+
+    # keep each pair of different indicators once
+    first, second = np.triu_indices(len(indicators), k=1)
+    corr = corr[..., first, second]
+
+    # create one row for each country and year
+    index = pd.MultiIndex.from_product([countries, years.astype(int)],
+                                       names=["Country Name", "Year"])
+    columns = pd.MultiIndex.from_arrays(
+        [[indicators[n] for n in first], [indicators[n] for n in second]],
+        names=["Indicator Name", "Indicator Name"])
+
+    # return the correlations as a dataframe
+    return pd.DataFrame(corr.reshape(len(index), len(first)),
+                        index=index, columns=columns)
 
 
 # function to get correlation over time
-def correlation_per_year(country_name):
+@traced
+def correlation_per_year(store, country_name, window_size=5):
     """
-    This function get the country name as an argument and produce the
-    correlation over time for selected indicators
+    This function get the climate store and the country name as arguments
+    and returns the correlation over time for selected indicators, with
+    years as index and the indicator pairs as columns
     """
 
-    # define the window size
-    window_size = 5
+    # calculate the correlations for each rolling window
+    corr_matrix_over_time = rolling_correlation_frame(
+        store, [country_name], window_size=window_size).loc[country_name]
 
-    # extract the country data
-    df_data = df_countries[df_countries["Country Name"] == country_name]
+    # return the years with a full window
+    return corr_matrix_over_time.dropna(how="all")
 
-    # filter the dataframe for the indicators you want to analyze
-    indicators = ['Urban population',
-                  'Forest area(%)',
-                  'CO2 emissions(mt)',
-                  'Forest area(%)',
-                  'Arable land(%)']
 
-    df_filtered = df_data[df_data['Indicator Name'].isin(indicators)]
+# function to compute the correlation matrices of many series at once
+def batched_correlations(cube, method="pearson"):
+    """
+    This function get a country x indicator x year array as an argument
+    and returns the country x indicator x indicator array of correlation
+    matrices, computed for all countries together with einsum. Missing
+    years are skipped pairwise like DataFrame.corr. With method
+    "spearman" the two series of each pair are ranked over the years where
+    both have data, with average ranks for ties, before the pearson
+    correlation (see spearman_correlations).
+    """
 
-    df_filtered['Year'] = df_filtered['Year'].astype(int)
+    # return the correlations of the sums over the years
+    cube = np.asarray(cube, dtype="float64")
+    if method == "spearman":
+        return spearman_correlations(cube)
+    if method != "pearson":
+        raise ValueError("method must be 'pearson' or 'spearman'")
+    return correlations_from_sums(*correlation_sums(cube))
 
-    # pivot the dataframe to have year as index and indicators as columns
-    df_pivot = df_filtered.pivot(index='Year',
-                                 columns='Indicator Name',
-                                 values='Total')
 
-    # calculate the correlation matrix for each rolling window
-    corr_matrix_over_time = df_pivot.rolling(window_size).corr()
+# number of indicator pairs ranked together by spearman_correlations
+RANK_BLOCK_SIZE = 16384
 
-    # select only the correlations between different indicators
-    corr_matrix_over_time = corr_matrix_over_time.unstack().iloc[:,
-                                                                 window_size-4::window_size]
 
-    # drop null values
-    corr_matrix_over_time.dropna()
+# function to compute the spearman correlations of many countries at once
+def spearman_correlations(cube):
+    """
+    This function get a country x indicator x year array as an argument
+    and returns the country x indicator x indicator array of spearman
+    correlations, like DataFrame.corr(method="spearman"): each pair is
+    ranked over the years where both series have data. Every series is
+    ranked once over its own years, which is already right for the pairs
+    of series with data in the same years, and only the pairs whose
+    series have data in different years are ranked again, in blocks.
+    """
 
-    # print the result
-    print(corr_matrix_over_time)
+    # rank every series over its own years and correlate the ranks
+    n_years = cube.shape[-1]
+    ranks = pd.DataFrame(cube.reshape(-1, n_years)).rank(
+        axis=1).to_numpy().reshape(cube.shape)
+    corr = correlations_from_sums(*correlation_sums(ranks))
+
+    # find the pairs whose series have data in different years
+    valid = ~np.isnan(cube)
+    pattern = np.unique(np.packbits(valid, axis=-1).reshape(
+        -1, (n_years + 7) // 8), axis=0, return_inverse=True)[1]
+    pattern = pattern.reshape(cube.shape[:2])
+    country, first, second = np.nonzero(np.triu(
+        pattern[:, :, np.newaxis] != pattern[:, np.newaxis, :], k=1))
+
+    # rank both series of those pairs over their common years
+    for start in range(0, len(country), RANK_BLOCK_SIZE):
+        block = slice(start, start + RANK_BLOCK_SIZE)
+        c, i, j = country[block], first[block], second[block]
+        both = valid[c, i] & valid[c, j]
+        pairs = np.stack([np.where(both, cube[c, i], np.nan),
+                          np.where(both, cube[c, j], np.nan)], axis=1)
+        pair_ranks = pd.DataFrame(pairs.reshape(-1, n_years)).rank(
+            axis=1).to_numpy().reshape(pairs.shape)
+
+        # correlate the ranks of each pair
+        pair_corr = correlations_from_sums(
+            *correlation_sums(pair_ranks))[:, 0, 1]
+        corr[c, i, j] = pair_corr
+        corr[c, j, i] = pair_corr
+
+    # return the correlations
+    return corr
+
+
+# function to find the correlation sufficient statistics of many countries
+def correlation_sums(cube):
+    """
+    This function get a country x indicator x year array as an argument
+    and returns the sufficient statistics of the correlation of every pair
+    of indicators of every country: the number of years where both series
+    have data and the sums of x_i, x_i * x_i and x_i * x_j over those
+    years, each as a country x indicator x indicator array. The series are
+    centered on their own means first to keep the sums small.
+    """
 
-    # end the function
-    return
+    # center each series and put zeros on the missing years
+    cube = np.asarray(cube, dtype="float64")
+    valid = ~np.isnan(cube)
+    mask = valid.astype("float64")
+    count = mask.sum(axis=2, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = np.where(valid, cube, 0).sum(axis=2, keepdims=True) / count
+    x = np.where(valid, cube - mean, 0)
 
+    # find the sums over the years where both series have data
+    n = np.einsum("ciy,cjy->cij", mask, mask)
+    s_i = np.einsum("ciy,cjy->cij", x, mask)
+    s_ii = np.einsum("ciy,cjy->cij", x * x, mask)
+    s_ij = np.einsum("ciy,cjy->cij", x, x)
 
-# function to create multiple line charts for CO2 emmission
-def plt_co2_emission_line_chart(df):
-    """ This ia a function to create a lineplot with multiple lines.
-    This function takes datafrme as an argument, and use year as x axis
-    and the total CO2 emission as y axis and plot lines for each country"""
+    # return the sums
+    return n, s_i, s_ii, s_ij
+
+
+# function to turn the correlation sufficient statistics into correlations
+def correlations_from_sums(n, s_i, s_ii, s_ij):
+    """
+    This function get the sufficient statistics of correlation_sums and
+    returns the country x indicator x indicator array of correlations.
+    Pairs with less than two years or without variation are NaN.
+    """
+
+    # get the sums of the second series of each pair
+    s_j = s_i.transpose(0, 2, 1)
+    s_jj = s_ii.transpose(0, 2, 1)
+
+    # find the correlation of each pair
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cov = s_ij - s_i * s_j / n
+        var_i = s_ii - s_i ** 2 / n
+        var_j = s_jj - s_j ** 2 / n
+        corr = cov / np.sqrt(var_i * var_j)
+
+    # drop the pairs without enough data or variation
+    corr[(n < 2) | ~(var_i > 0) | ~(var_j > 0)] = np.nan
+
+    # return the correlations
+    return np.clip(corr, -1, 1)
+
+
+# function to get the correlation matrices of all countries
+@traced
+def all_country_correlations(df_climate, method="pearson"):
+    """
+    This function get the climate table as an argument and returns the
+    correlation matrices of all countries in one dataframe, with country
+    and indicator as index and indicators as columns
+    """
+
+    # get the country x indicator x year array
+    cube, countries, indicators, years = climate_cube(df_climate)
+
+    # compute the correlations of all countries at once
+    corr = batched_correlations(cube, method)
+
+    # create one row for each country and indicator
+    index = pd.MultiIndex.from_product([countries, indicators],
+                                       names=["Country Name",
+                                              "Indicator Name"])
+    columns = pd.Index(indicators, name="Indicator Name")
+
+    # return the correlations as a dataframe
+    return pd.DataFrame(corr.reshape(-1, len(indicators)),
+                        index=index, columns=columns)
+
+
+# indicators compared by the country similarity index
+SIMILARITY_INDICATORS = ['CO2 emissions(mt)',
+                         'Forest area(%)',
+                         'Renew. energy consump(%)']
+
+
+# class to find the countries with the most similar trajectories
+class SimilarityIndex:
+    """
+    This class finds the countries whose indicator trajectories are the
+    most similar to those of a given country. Each series is normalized
+    to zero mean and unit variance over the years, so countries are
+    compared by the shape of their trajectories and not by their level,
+    and the series of a country are joined into one vector. Only the
+    countries with complete series of all the indicators are indexed.
+    The distances are euclidean distances between the vectors, found for
+    all countries at once from their dot products. With dimensions, an
+    approximate index of random projections of the vectors is also built
+    to pick the candidates of the approximate queries.
+    """
+
+    def __init__(self, store, indicators=SIMILARITY_INDICATORS,
+                 dimensions=None, seed=0):
+
+        # get the country x indicator x year array
+        cube, countries, all_indicators, years = store.cube()
+
+        # select the indicators and the countries with all their series
+        indicators = [i for i in dict.fromkeys(indicators)
+                      if i in all_indicators]
+        cube = cube[:, [all_indicators.index(i) for i in indicators]]
+        complete = ~np.isnan(cube).any(axis=(1, 2))
+        self.countries = [c for c, keep in zip(countries, complete) if keep]
+        self.indicators = indicators
+        self._position = {c: n for n, c in enumerate(self.countries)}
+
+        # normalize each series, constant series become zeros
+        cube = cube[complete]
+        std = cube.std(axis=2, keepdims=True)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cube = np.where(std > 0, (cube - cube.mean(axis=2, keepdims=True))
+                            / std, 0)
+
+        # join the series of each country into one vector
+        self.vectors = cube.reshape(len(self.countries), -1)
+        self.norms = (self.vectors ** 2).sum(axis=1)
+
+        # project the vectors on random directions for the approximate index
+        self.projection = None
+        if dimensions is not None:
+            rng = np.random.default_rng(seed)
+            self.projection = rng.normal(
+                0, 1 / np.sqrt(dimensions),
+                (self.vectors.shape[1], dimensions))
+            self.projected = self.vectors @ self.projection
+            self.projected_norms = (self.projected ** 2).sum(axis=1)
+
+    def distances(self):
+        """
+        Return the distances between all pairs of indexed countries, from
+        the gram matrix of their vectors
+        """
+
+        # find the squared distances from the dot products
+        gram = self.vectors @ self.vectors.T
+        squared = self.norms[:, np.newaxis] + self.norms - 2 * gram
+
+        # return the distances
+        return pd.DataFrame(np.sqrt(np.maximum(squared, 0)),
+                            index=self.countries, columns=self.countries)
+
+    def query(self, country_name, k=5, approximate=False, candidates=4):
+        """
+        Return the k countries nearest to given country with their
+        distances, nearest first. Approximate queries rank the countries
+        on the random projections and find the exact distances of only
+        the candidates * k nearest of them.
+        """
+
+        # check the country
+        if country_name not in self._position:
+            raise KeyError(country_name + " is not in the similarity index")
+        n = self._position[country_name]
+
+        # pick the candidates on the random projections
+        others = np.arange(len(self.countries))
+        if approximate:
+            if self.projection is None:
+                raise ValueError("the index was built without dimensions")
+            squared = (self.projected_norms + self.projected_norms[n] -
+                       2 * self.projected @ self.projected[n])
+            squared[n] = np.inf
+            m = min(candidates * k, len(others) - 1)
+            others = (np.argpartition(squared, m - 1)[:m] if m > 0
+                      else others[:0])
+
+        # find the exact distances of the candidates, without the country
+        others = others[others != n]
+        squared = (self.norms[others] + self.norms[n] -
+                   2 * self.vectors[others] @ self.vectors[n])
+
+        # keep the k nearest and sort them
+        k = min(k, len(others))
+        nearest = (np.argpartition(squared, k - 1)[:k] if k > 0
+                   else others[:0])
+        nearest = nearest[np.argsort(squared[nearest], kind="stable")]
+
+        # return the countries and their distances
+        return pd.DataFrame(
+            {"Distance": np.sqrt(np.maximum(squared[nearest], 0))},
+            index=pd.Index([self.countries[c] for c in others[nearest]],
+                           name="Country Name"))
+
+
+# function to build the aggregates of a large file chunk by chunk
+@traced
+def aggregate_climate_data(filename, chunksize=CHUNK_SIZE, catalog=None,
+                           all_indicators=False):
+    """
+    This function reads a World Bank file chunk by chunk without keeping
+    its rows and returns its ClimateAggregates: the moments of every
+    country and indicator and the correlation sufficient statistics of
+    the catalog indicators of every country. Only the catalog indicators
+    are read, or every indicator of the file with all_indicators.
+    The rows of each country must be next to each other, as in the World
+    Bank exports, since the rows of the last country of each chunk are
+    carried over to the next chunk.
+    """
 
-    # create dataframes for countries
-    df_brazil = df[df["Country Name"] == "Brazil"]
-    df_germany = df[df["Country Name"] == "Germany"]
-    df_china = df[df["Country Name"] == "China"]
-    df_india = df[df["Country Name"] == "India"]
-    df_USA = df[df["Country Name"] == "United States"]
-    df_UK = df[df["Country Name"] == "United Kingdom"]
+    # read the default catalog
+    if catalog is None:
+        catalog = load_indicator_catalog()
+
+    # find the year columns in the file
+    header = pd.read_csv(filename, skiprows=4, nrows=0).columns
+    first_year = min(entry["first_year"] for entry in catalog.values())
+    last_year = max(entry["last_year"] for entry in catalog.values())
+    if all_indicators:
+        first_year = min(first_year, FIRST_YEAR)
+        last_year = max(last_year, LAST_YEAR)
+    year_cols = [c for c in header
+                 if c.isdigit() and first_year <= int(c) <= last_year]
+
+    # read data from csv chunk by chunk
+    id_cols = ["Country Name", "Country Code", "Indicator Name",
+               "Indicator Code"]
+    dtypes = dict.fromkeys(id_cols, str)
+    dtypes.update(dict.fromkeys(year_cols, "float64"))
+    reader = pd.read_csv(filename,
+                         skiprows=4,
+                         usecols=id_cols + year_cols,
+                         dtype=dtypes,
+                         chunksize=chunksize)
+
+    # find the position of each catalog indicator in the correlations
+    codes = list(catalog)
+    position = {code: i for i, code in enumerate(codes)}
+    names = {code: entry["name"] for code, entry in catalog.items()}
+
+    # keep the aggregates of each block of countries
+    moments = []
+    correlations = []
+    finished = set()
+
+    # function to add the aggregates of the rows of whole countries
+    def add_block(block):
+        """ Add the aggregates of a block with all rows of its countries """
+
+        # check that no country was split over two blocks
+        block_countries = set(block["Country Code"])
+        if block_countries & finished:
+            raise ValueError("the rows of each country must be next to "
+                             "each other in " + str(filename))
+        finished.update(block_countries)
+
+        # blank the years outside the years of each indicator
+        block_codes = block["Indicator Code"]
+        values = blank_outside_years(block[year_cols], block_codes,
+                                     catalog).to_numpy()
+
+        # accumulate the moments of every row without a sketch, each row
+        # being a whole series its quartiles are exact
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            quartiles = np.nanquantile(values, DESCRIBE_QUANTILES, axis=1)
+        moments.append((block["Country Name"].to_numpy(),
+                        block_codes.map(names).fillna(
+                            block["Indicator Name"]).to_numpy(),
+                        quartiles.T,
+                        MomentAccumulator((len(block),), 0).update(values)))
+
+        # put the catalog indicators of each country into a cube
+        rows = block_codes.isin(position).to_numpy()
+        country_pos, block_countries = pd.factorize(
+            block["Country Name"][rows])
+        cube = np.full((len(block_countries), len(codes), len(year_cols)),
+                       np.nan)
+        cube[country_pos, block_codes[rows].map(position).to_numpy()] = \
+            values[rows]
+
+        # find the correlation sums of each country
+        correlations.append((list(block_countries), correlation_sums(cube)))
+
+    # aggregate the chunks, keeping back the rows of their last country
+    carry = None
+    for chunk in reader:
+
+        # keep only the catalog indicators unless all are asked
+        if not all_indicators:
+            chunk = chunk[chunk["Indicator Code"].isin(position)]
+
+        # add the rows carried over from the last chunk
+        if carry is not None:
+            chunk = pd.concat([carry, chunk], ignore_index=True)
+        if not len(chunk):
+            continue
+
+        # aggregate the countries which ended in this chunk
+        last = (chunk["Country Code"] == chunk["Country Code"].iloc[-1])
+        if not last.all():
+            add_block(chunk[~last])
+        carry = chunk[last]
+
+    # aggregate the last country
+    if carry is not None and len(carry):
+        add_block(carry)
+
+    # join the moments of all blocks
+    index = pd.MultiIndex.from_arrays(
+        [np.concatenate([m[0] for m in moments]) if moments else [],
+         np.concatenate([m[1] for m in moments]) if moments else []],
+        names=["Country Name", "Indicator Name"])
+    quartiles = (np.concatenate([m[2] for m in moments]) if moments
+                 else np.empty((0, len(DESCRIBE_QUANTILES))))
+    accumulator = MomentAccumulator.concatenate([m[3] for m in moments], 0)
+
+    # join the correlation sums of all blocks
+    countries = [c for block in correlations for c in block[0]]
+    corr_sums = tuple(np.concatenate([block[1][k] for block in correlations])
+                      if correlations
+                      else np.empty((0, len(codes), len(codes)))
+                      for k in range(4))
+
+    # return the aggregates
+    return ClimateAggregates(index, accumulator, quartiles, countries,
+                             [names[code] for code in codes], corr_sums)
+
+
+# class to keep the aggregates of a file too large for memory
+class ClimateAggregates:
+    """
+    This class keeps the aggregates built chunk by chunk by
+    aggregate_climate_data: the moments and the quartiles of every
+    country and indicator and the correlation sufficient statistics of
+    every country (see correlation_sums). The moments, the summary
+    statistics and the correlations are produced from them without the
+    rows of the file.
+    """
+
+    def __init__(self, index, accumulator, quartiles, countries, indicators,
+                 corr_sums):
+
+        # keep the moments and quartiles of each country and indicator
+        self.index = index
+        self.accumulator = accumulator
+        self.quartiles = quartiles
+
+        # keep the correlation sums of each country
+        self.countries = countries
+        self.indicators = indicators
+        self.corr_sums = corr_sums
+
+    def moments(self):
+        """ Return the moments of every country and indicator """
+        return self.accumulator.moments(self.index)
+
+    def describe(self, indicator_name, countries=None):
+        """
+        Return the summary statistics of the indicator with one column per
+        country, like describe
+        """
+
+        # summarise the rows of the indicator
+        rows = self.index.get_level_values(1) == indicator_name
+        df_describe = self.accumulator.take(rows).describe(
+            self.index[rows].get_level_values(0),
+            quantiles=self.quartiles[rows])
+        df_describe.columns.name = None
+
+        # keep the given countries
+        if countries is not None:
+            df_describe = df_describe[[c for c in countries
+                                       if c in df_describe.columns]]
+        return df_describe
+
+    def correlation(self, country_name):
+        """ Return the correlation matrix of the indicators of a country """
+
+        # find the correlations from the sums of the country
+        i = self.countries.index(country_name)
+        corr = correlations_from_sums(*(a[i:i + 1] for a in self.corr_sums))
+
+        # return the correlations as a dataframe
+        indicators = pd.Index(self.indicators, name="Indicator Name")
+        return pd.DataFrame(corr[0], index=indicators, columns=indicators)
+
+    def correlations(self):
+        """
+        Return the correlation matrices of all countries in one dataframe,
+        like all_country_correlations
+        """
+
+        # find the correlations of all countries at once
+        corr = correlations_from_sums(*self.corr_sums)
+
+        # create one row for each country and indicator
+        index = pd.MultiIndex.from_product([self.countries, self.indicators],
+                                           names=["Country Name",
+                                                  "Indicator Name"])
+        columns = pd.Index(self.indicators, name="Indicator Name")
+
+        # return the correlations as a dataframe
+        return pd.DataFrame(corr.reshape(-1, len(self.indicators)),
+                            index=index, columns=columns)
+
+
+# number of correlation matrices kept in memory
+CORRELATION_CACHE_SIZE = 256
+
+
+# function to build the key of a correlation matrix in the cache
+def _correlation_key(country_name, indicators, years, method):
+    """ Return the hashable key of a matrix of the correlation cache """
+
+    return (country_name,
+            None if indicators is None else tuple(indicators),
+            None if years is None else tuple(years),
+            method)
+
+
+# class to keep the correlation matrices of the countries
+class CorrelationCache:
+    """
+    This class keeps the most recently used correlation matrices of the
+    countries, so every consumer of a matrix shares one computation. The
+    matrices are keyed by country, indicators, years and method, and the
+    least recently used one is dropped when the cache is full. The
+    returned dataframes are shared and must not be modified. The cache can
+    be used from several threads.
+    """
+
+    def __init__(self, maxsize=CORRELATION_CACHE_SIZE):
+        """
+        This function get the largest number of matrices to keep as an
+        argument and creates the empty cache
+        """
+
+        # keep the size and the matrices in the order of their use
+        self.maxsize = maxsize
+        self._matrices = OrderedDict()
+        self._lock = threading.Lock()
+
+        # count the hits and misses of the cache
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, df_climate, country_name, indicators=None, years=None,
+            method="pearson"):
+        """
+        This function returns the correlation matrix of the indicators of
+        given country over the given (first, last) years from the cache,
+        computing it from the climate table only on the first request
+        """
+
+        # return the cached matrix
+        corr_matrix = self.cached(country_name, indicators, years, method)
+        if corr_matrix is not None:
+            return corr_matrix
+
+        # extract the given country data
+        df_state = extract_country_data(df_climate, country_name)
+
+        # select the indicators and years
+        if indicators is not None:
+            df_state = df_state[[i for i in indicators
+                                 if i in df_state.columns]]
+        if years is not None:
+            df_state = df_state.loc[years[0]:years[1]]
+
+        # create correlation matrix and store it
+        corr_matrix = df_state.corr(method=method)
+        self.put(corr_matrix, country_name, indicators, years, method)
+
+        # return the matrix
+        return corr_matrix
+
+    def cached(self, country_name, indicators=None, years=None,
+               method="pearson"):
+        """
+        This function returns the cached correlation matrix of given
+        country, indicators, years and method, or None when it has not
+        been computed yet
+        """
+
+        # count a miss when the matrix is not cached
+        key = _correlation_key(country_name, indicators, years, method)
+        with self._lock:
+            if key not in self._matrices:
+                self.misses += 1
+                return None
+
+            # return the cached matrix and mark it as recently used
+            self.hits += 1
+            self._matrices.move_to_end(key)
+            return self._matrices[key]
+
+    def put(self, corr_matrix, country_name, indicators=None, years=None,
+            method="pearson"):
+        """
+        This function stores a correlation matrix computed elsewhere, for
+        example in a worker process, and drops the least recently used one
+        when the cache is full
+        """
+
+        # store the matrix and drop the least recently used one
+        key = _correlation_key(country_name, indicators, years, method)
+        with self._lock:
+            self._matrices[key] = corr_matrix
+            self._matrices.move_to_end(key)
+            if len(self._matrices) > self.maxsize:
+                self._matrices.popitem(last=False)
+
+        # end the function
+        return
+
+    def invalidate(self, countries=None):
+        """
+        This function drops the matrices of the given countries, or all
+        matrices when no countries are given, after the data changed
+        """
+
+        # drop every matrix
+        with self._lock:
+            if countries is None:
+                self._matrices.clear()
+                return
+
+            # drop the matrices of the given countries
+            countries = set(countries)
+            for key in [k for k in self._matrices if k[0] in countries]:
+                del self._matrices[key]
+
+
+# function to save a correlation heatmap without the pyplot state
+def save_heat_map(corr_matrix, country_name, filename, cmap="coolwarm"):
+    """ This ia a function to save a heatmap of a correlation matrix.
+    It draws on its own figure instead of the pyplot figures, so it can
+    run in worker threads and processes."""
 
     # make the figure
-    plt.figure()
+    fig = Figure()
+    ax = fig.subplots()
 
-    # use multiple x and y for plot multiple lines
-    plt.plot(df_brazil["Year"], df_brazil["Total"], label="Brazil")
-    plt.plot(df_china["Year"], df_china["Total"], label="China")
-    plt.plot(df_germany["Year"], df_germany["Total"], label="Germany")
-    plt.plot(df_india["Year"], df_india["Total"], label="India")
-    plt.plot(df_USA["Year"], df_USA["Total"], label="USA")
-    plt.plot(df_UK["Year"], df_UK["Total"], label="UK")
+    # plot heatmap
+    sns.heatmap(corr_matrix, cmap=cmap, annot=True, ax=ax)
 
-    # labeling
-    plt.xlabel("Year", labelpad=(10), fontweight="bold")
-    plt.ylabel("CO2 emissions (mt)", labelpad=(10), fontweight="bold")
+    # rotate the x-axis labels by 45 degrees
+    ax.tick_params(axis="x", labelrotation=45)
 
-    # add a title and legend
-    plt.title("Total CO2 emissions by country ", fontweight="bold", y=1.1)
-    plt.legend(loc='center left',
-               bbox_to_anchor=(1, 0.5),
-               fancybox=True,
-               shadow=True)
+    # set the plot title
+    ax.set_title('Correlation between Indicators in ' + country_name,
+                 fontweight="bold", y=1.05)
+    ax.set_xlabel("")
+    ax.set_ylabel("")
+
+    # save the plot as png
+    fig.savefig(filename, bbox_inches="tight")
+
+    # return the file name
+    return filename
+
+
+# function to create the report of one country
+def country_report(country_name, df_state, df_corr=None, heat_map_dir=None):
+    """
+    This function get the country name, the country dataframe, its
+    correlation matrix when already known and the heatmap folder as
+    arguments and returns the summary statistics, the correlation matrix
+    and the heatmap file of given country
+    """
+
+    # extract statistical properties
+    df_describe = describe_frame(df_state)
+
+    # calculate the correlation when it is not known
+    if df_corr is None:
+        df_corr = df_state.corr()
+
+    # save the heatmap when a folder is given
+    heat_map = None
+    if heat_map_dir is not None:
+        heat_map = save_heat_map(
+            df_corr, country_name,
+            os.path.join(heat_map_dir,
+                         "heat_map_{}.png".format(
+                             country_name.replace(" ", "_"))))
+
+    # return the report of the country
+    return {"describe": df_describe,
+            "correlation": df_corr,
+            "heat_map": heat_map}
+
+
+# function to create the reports of many countries in parallel
+@traced
+def country_reports(df_climate, countries, max_workers=None,
+                    executor="process", heat_map_dir=None,
+                    correlations=None):
+    """
+    This function get the climate table and a list of countries as
+    arguments and creates the report of each country on a pool of
+    processes or threads. The correlation matrices are taken from the
+    correlations cache when one is given; the missing ones are computed by
+    the workers and added to the cache afterwards. The reports are
+    returned in a dictionary in the order of the given countries.
+    """
+
+    # extract the data of every country before starting the workers
+    frames = [extract_country_data(df_climate, c) for c in countries]
+
+    # take the known correlation matrices from the cache
+    if correlations is not None:
+        matrices = [correlations.cached(c) for c in countries]
+    else:
+        matrices = [None] * len(countries)
+
+    # create the heatmap folder
+    if heat_map_dir is not None:
+        os.makedirs(heat_map_dir, exist_ok=True)
+
+    # select the type of the pool
+    if executor == "process":
+        pool_class = ProcessPoolExecutor
+    elif executor == "thread":
+        pool_class = ThreadPoolExecutor
+    else:
+        raise ValueError("executor must be 'process' or 'thread'")
+
+    # create the reports, map keeps the order of the countries
+    with pool_class(max_workers=max_workers) as pool:
+        reports = list(pool.map(country_report,
+                                countries,
+                                frames,
+                                matrices,
+                                repeat(heat_map_dir)))
+
+    # add the matrices computed by the workers to the cache
+    if correlations is not None:
+        for country, matrix, report in zip(countries, matrices, reports):
+            if matrix is None:
+                correlations.put(report["correlation"], country)
+
+    # return the reports of all countries
+    return dict(zip(countries, reports))
+
+
+# function to get the complete series of the climate table
+@traced
+def compact_climate_data(df_climate):
+    """
+    This function get the climate table as an argument and returns its
+    rows for the countries and indicators without missing years, with one
+    year column. It replaces melting the year dataframe: the country and
+    indicator columns stay categorical and the years stay int16, so the
+    names are not repeated as strings on every row.
+    """
+
+    # find the series without missing years
+    cube, countries, indicators, years = climate_cube(df_climate)
+    complete = ~np.isnan(cube).any(axis=2)
+
+    # keep every year of the complete series
+    df_year_new = df_climate[np.repeat(complete.ravel(), len(years))]
+
+    # return the compact dataframe
+    return df_year_new.reset_index(drop=True)
+
+
+# function to select the rows of some countries
+def select_countries(df_long, countries):
+    """
+    This function get a long dataframe with a categorical country column
+    and a list of countries as arguments and returns the rows of the given
+    countries. The countries are matched on the category codes, so no
+    string is compared row by row.
+    """
+
+    # find the codes of the given countries
+    categories = df_long["Country Name"].cat.categories
+    wanted = categories.get_indexer(countries)
+
+    # keep the rows with one of the codes
+    codes = df_long["Country Name"].cat.codes.to_numpy()
+    return df_long[np.isin(codes, wanted[wanted >= 0])]
+
+
+# class to look up country and indicator data without scanning the data
+class ClimateStore:
+    """
+    This class keeps the long climate data sorted by country, indicator
+    and year together with the first and last row of each country and
+    indicator, so the data of a country or an indicator is sliced
+    directly instead of filtering the whole dataframe.
+    """
+
+    @traced
+    def __init__(self, df_year_new):
+        """
+        This function get the long dataframe as an argument and build
+        the index of the store once
+        """
+
+        # keep the columns of the long dataframe
+        self.columns = list(df_year_new.columns)
+
+        # keep the countries and indicators in the order of the file
+        df_data = df_year_new.copy()
+        for col in ("Country Name", "Indicator Name"):
+            df_data[col] = pd.Categorical(
+                df_data[col], categories=pd.unique(df_data[col]))
+
+        # sort once so the rows of each group are next to each other
+        df_data = df_data.sort_values(["Country Name",
+                                       "Indicator Name",
+                                       "Year"],
+                                      kind="mergesort")
+
+        # index the rows by country, indicator and year
+        self.frame = df_data.set_index(["Country Name",
+                                        "Indicator Name",
+                                        "Year"])
+
+        # keep the years and values as arrays for slicing
+        self.years = df_data["Year"].to_numpy()
+        self.values = df_data["Total"].to_numpy(dtype="float64")
+
+        # find the first and last row of each group in one groupby pass
+        sizes = df_data.groupby(["Country Name", "Indicator Name"],
+                                sort=False, observed=True).size()
+        stops = sizes.to_numpy().cumsum()
+        self._offsets = dict(zip(sizes.index,
+                                 zip(stops - sizes.to_numpy(), stops)))
+
+        # the 3-D array is created on the first use
+        self._cube = None
+
+    @property
+    def countries(self):
+        """ The countries of the store in the order of the file """
+
+        return list(dict.fromkeys(c for c, _ in self._offsets))
+
+    @property
+    def indicators(self):
+        """ The indicators of the store in the order of the file """
+
+        return list(dict.fromkeys(i for _, i in self._offsets))
+
+    def has(self, country_name, indicator_name):
+        """ Check whether the store has data for a country and indicator """
+
+        return (country_name, indicator_name) in self._offsets
+
+    def series(self, country_name, indicator_name):
+        """
+        This function returns the years and the values of given country
+        and indicator as arrays
+        """
+
+        # slice the rows of the group, empty when there is no data
+        start, stop = self._offsets.get((country_name, indicator_name),
+                                        (0, 0))
+        return self.years[start:stop], self.values[start:stop]
+
+    def rows(self, indicator_name, countries):
+        """
+        This function returns the rows of given indicator for the given
+        countries as a long dataframe
+        """
+
+        # collect the row positions of each group
+        positions = [np.arange(*self._offsets[(c, indicator_name)])
+                     for c in countries if self.has(c, indicator_name)]
+        if not positions:
+            return self.frame.iloc[:0].reset_index()[self.columns]
+
+        # take the rows of all groups at once
+        df_rows = self.frame.iloc[np.concatenate(positions)].reset_index()
+        return df_rows[self.columns]
+
+    def indicator_frame(self, indicator_name, countries=None):
+        """
+        This function returns a dataframe of given indicator with years as
+        index and countries as columns
+        """
+
+        # use all countries when none are given
+        if countries is None:
+            countries = self.countries
+
+        # create a series for each country with data
+        data = {}
+        for c in countries:
+            if self.has(c, indicator_name):
+                years, values = self.series(c, indicator_name)
+                data[c] = pd.Series(values, index=years)
+
+        # join the series into one dataframe
+        df_indicator = pd.DataFrame(data)
+        df_indicator.columns.name = "Country Name"
+        return df_indicator
+
+    def cube(self):
+        """
+        This function returns the data as a 3-D array of countries,
+        indicators and years, with NaN where there is no data, together
+        with the countries, indicators and years of the axes
+        """
+
+        # build the array only on the first call
+        if self._cube is None:
+
+            # find the axes of the array
+            countries = self.countries
+            indicators = self.indicators
+            years = np.unique(self.years)
+
+            # find the position of each row on every axis
+            index = self.frame.index
+            c_pos = pd.Categorical(index.get_level_values(0),
+                                   categories=countries).codes
+            i_pos = pd.Categorical(index.get_level_values(1),
+                                   categories=indicators).codes
+            y_pos = np.searchsorted(years, self.years)
+
+            # scatter all the values into the array at once
+            cube = np.full((len(countries), len(indicators), len(years)),
+                           np.nan)
+            cube[c_pos, i_pos, y_pos] = self.values
+
+            # keep the array and its axes
+            self._cube = cube, countries, indicators, years
+
+        # return the array and its axes
+        return self._cube
+
+
+# name of the figure reused by the headless rendering
+HEADLESS_FIGURE = "headless"
+
+# whether the charts are rendered without showing them
+_headless = False
+
+
+# function to render the charts without a display
+def use_headless_backend():
+    """
+    This function switches matplotlib to the non-GUI Agg backend. After
+    that the charts are only saved, never shown, and all of them are drawn
+    on one reused figure that is cleared after saving, so any number of
+    charts can be rendered in one process without blocking.
+    """
+
+    global _headless
+
+    # select the non-GUI backend
+    plt.switch_backend("Agg")
+    _headless = True
+
+
+# function to make a figure for a chart
+def new_figure():
+    """
+    This function returns a new figure, or the cleared reused figure when
+    rendering headless
+    """
 
-    plt.xticks(rotation=90)
+    # reuse one figure when rendering headless
+    if _headless:
+        return plt.figure(num=HEADLESS_FIGURE, clear=True)
+
+    # make a new figure otherwise
+    return plt.figure()
+
+
+# function to save a chart and release its figure
+@traced
+def finish_figure(fig, output):
+    """
+    This function saves the figure as png into output, which is a file
+    path or a file like object such as io.BytesIO. The figure is shown
+    and closed, or only cleared for reuse when rendering headless.
+    """
 
     # save the plot as png
-    plt.savefig("CO2_line_chart.png")
+    fig.savefig(output, format="png")
 
-    # show the plot
-    plt.show()
+    # clear the reused figure when rendering headless
+    if _headless:
+        fig.clf()
 
-    # end the function
-    return
+    # show the plot and close the figure otherwise
+    else:
+        plt.show()
+        plt.close(fig)
 
+    # return the output
+    return output
 
-# function to create multiple line charts for urban population
-def plot_urban_pop_line_chart(df):
+
+# function to render a chart into memory
+def render_to_buffer(plot_function, *args, **kwargs):
+    """
+    This function calls a plot function with an in-memory buffer as output
+    and returns the png bytes of the chart
+    """
+
+    # plot into the buffer
+    buffer = io.BytesIO()
+    plot_function(*args, output=buffer, **kwargs)
+
+    # return the png bytes
+    return buffer.getvalue()
+
+
+# function to create a line chart of one indicator for many countries
+@traced
+def plot_indicator_line_chart(store, indicator_name, countries, output,
+                              ylabel, title, labels=None, linestyles=None,
+                              legend_outside=True):
     """ This ia a function to create a lineplot with multiple lines.
-    This function takes datafrme as an argument, and use year as x axis
-    and the total urban population n as y axis and plot lines for
-    each country"""
-
-    # create dataframes for countries
-    df_brazil = df[df["Country Name"] == "Brazil"]
-    df_germany = df[df["Country Name"] == "Germany"]
-    df_china = df[df["Country Name"] == "China"]
-    df_india = df[df["Country Name"] == "India"]
-    df_USA = df[df["Country Name"] == "USA"]
-    df_UK = df[df["Country Name"] == "UK"]
+    This function takes the climate store, an indicator and a list of
+    countries as arguments, and use year as x axis and the indicator as
+    y axis and plot a line for each country. labels and linestyles are
+    optional dictionaries with the label and line style of each country.
+    All lines are drawn at once as one LineCollection from the arrays of
+    the store. The plot is saved into output, which is a file path or a
+    file like object"""
+
+    # use the country names and solid lines by default
+    labels = labels or {}
+    linestyles = linestyles or {}
+
+    # keep the countries with data for the indicator
+    countries = [c for c in countries if store.has(c, indicator_name)]
+
+    # split the year and value arrays of each country from the store
+    segments = []
+    for c in countries:
+        years, values = store.series(c, indicator_name)
+        segments.append(np.column_stack((years.astype("float64"), values)))
+
+    # pick a color from the color cycle for each country
+    cycle = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+    colors = [cycle[n % len(cycle)] for n in range(len(countries))]
+    styles = [linestyles.get(c, "solid") for c in countries]
 
     # make the figure
-    plt.figure()
+    fig = new_figure()
+    ax = fig.gca()
+
+    # draw all the lines at once
+    ax.add_collection(LineCollection(segments,
+                                     colors=colors,
+                                     linestyles=styles))
+    ax.autoscale_view()
 
-    # use multiple x and y for plot multiple lines
-    plt.plot(df_brazil["Year"], df_brazil["Total"], label="Brazil")
-    plt.plot(df_china["Year"], df_china["Total"], label="China")
-    plt.plot(df_germany["Year"], df_germany["Total"], label="Germany")
-    plt.plot(df_india["Year"], df_india["Total"], label="India")
-    plt.plot(df_USA["Year"], df_USA["Total"], label="USA")
-    plt.plot(df_UK["Year"], df_UK["Total"], label="UK")
+    # show every year on the x axis
+    if segments:
+        years = np.unique(np.concatenate([seg[:, 0] for seg in segments]))
+        ax.set_xticks(years)
+        ax.set_xticklabels(years.astype(int), rotation=90)
 
     # labeling
-    plt.xlabel("Year", labelpad=(10), fontweight="bold")
-    plt.ylabel("Population", labelpad=(10), fontweight="bold")
+    ax.set_xlabel("Year", labelpad=(10), fontweight="bold")
+    ax.set_ylabel(ylabel, labelpad=(10), fontweight="bold")
+
+    # create a legend entry for each line
+    handles = [Line2D([], [], color=color, linestyle=style,
+                      label=labels.get(c, c))
+               for c, color, style in zip(countries, colors, styles)]
 
     # add a title and legend
-    plt.title("Urban population by country ", fontweight="bold", y=1.1)
-    plt.legend()
+    ax.set_title(title, fontweight="bold", y=1.1)
+    if legend_outside:
+        ax.legend(handles=handles,
+                  loc='center left',
+                  bbox_to_anchor=(1, 0.5),
+                  fancybox=True,
+                  shadow=True)
+    else:
+        ax.legend(handles=handles)
+
+    # save the plot and show or release the figure
+    finish_figure(fig, output)
 
-    plt.xticks(rotation=90)
+    # end the function
+    return
+
+
+# short labels of the countries in the charts
+COUNTRY_LABELS = {"United States": "USA", "United Kingdom": "UK"}
+
+
+# function to create multiple line charts for CO2 emmission
+def plt_co2_emission_line_chart(store, output="CO2_line_chart.png"):
+    """ This ia a function to create a lineplot with multiple lines for the
+    total CO2 emission of each country. The plot is saved into output,
+    which is a file path or a file like object"""
+
+    # plot the countries with the line chart engine
+    plot_indicator_line_chart(store, "CO2 emissions(mt)",
+                              ["Brazil", "China", "Germany", "India",
+                               "United States", "United Kingdom"],
+                              output,
+                              ylabel="CO2 emissions (mt)",
+                              title="Total CO2 emissions by country ",
+                              labels=COUNTRY_LABELS)
+
+    # end the function
+    return
 
-    # save the plot as png
-    plt.savefig("Urb_line_chart.png")
 
-    # show the plot
-    plt.show()
+# function to create multiple line charts for urban population
+def plot_urban_pop_line_chart(store, output="Urb_line_chart.png"):
+    """ This ia a function to create a lineplot with multiple lines for the
+    total urban population of each country. The plot is saved into output,
+    which is a file path or a file like object"""
+
+    # plot the countries with the line chart engine
+    plot_indicator_line_chart(store, "Urban population",
+                              ["Brazil", "China", "Germany", "India",
+                               "United States", "United Kingdom"],
+                              output,
+                              ylabel="Population",
+                              title="Urban population by country ",
+                              labels=COUNTRY_LABELS,
+                              legend_outside=False)
 
     # end the function
     return
 
 
+# years and colors of the bars in the renewable energy chart
+BAR_YEARS = [1990, 1995, 2000, 2005, 2010, 2015]
+BAR_COLORS = ["#0b84a5", "#f6c85f", "#9dd866", "#ca472f", "#8dddd0", "#6f4e7c"]
+
+
 # create a function for plot bar chart
-def plot_renew_energy_bar_graph(df):
+@traced
+def plot_renew_energy_bar_graph(store, countries=None,
+                                output="renew_energy_bar_chart.png",
+                                years=BAR_YEARS):
     """ This ia a function to create a grouped bar chart.
-    This function takes datafrme as anargument, and plot
-    multiple bars grouped by country. """
+    This function takes the climate store, countries and years as
+    arguments, and plot one bar for each year grouped by country. All
+    countries are used when none are given. The bar positions of all
+    years and countries are computed at once and drawn in one call. The
+    plot is saved into output, which is a file path or a file like
+    object"""
 
-    # create dataframes for plot bar graph
-    df_1990 = df[df["Year"] == "1990"]
-    df_1995 = df[df["Year"] == "1995"]
-    df_2000 = df[df["Year"] == "2000"]
-    df_2005 = df[df["Year"] == "2005"]
-    df_2010 = df[df["Year"] == "2010"]
-    df_2015 = df[df["Year"] == "2015"]
+    # create a pivot with years as index and countries as columns
+    df_renew = store.indicator_frame("Renew. energy consump(%)",
+                                     None if countries is None
+                                     else sorted(countries))
 
-    # make the figure
-    plt.figure()
-
-    # create the position of bars
-    x_pos = np.arange(len(df_1990))
-
-    # create x labels
-    tick_labels = ["Australia", "Brazil", "Canada",
-                   "China", "Germny", "India", "Japan", "UK", "USA"]
-
-    # plot the bars
-    plt.bar(x_pos - 0.2,
-            df_1990["Total"],
-            width=0.1,
-            label="1990",
-            color="#0b84a5")
-    plt.bar(x_pos - 0.1,
-            df_1995["Total"],
-            width=0.1,
-            label="1995",
-            color="#f6c85f")
-    plt.bar(x_pos,
-            df_2000["Total"],
-            width=0.1,
-            label="2000",
-            color="#9dd866")
-    plt.bar(x_pos + 0.1,
-            df_2005["Total"],
-            width=0.1,
-            label="2005",
-            color="#ca472f")
-    plt.bar(x_pos + 0.2,
-            df_2010["Total"],
-            width=0.1,
-            label="2010",
-            color="#8dddd0")
-    plt.bar(x_pos + 0.3,
-            df_2015["Total"],
-            width=0.1,
-            label="2015",
-            color="#6f4e7c")
+    # keep the rows of the selected years
+    df_renew = df_renew[df_renew.index.astype(int).isin(years)]
 
-    # labeling
-    plt.xlabel("Country", labelpad=(10), fontweight="bold")
-    plt.ylabel("Renewable energy consumption(% energy consump.)",
-               fontsize=(8), labelpad=(10), fontweight="bold")
-    plt.xticks(x_pos, tick_labels, rotation=90)
+    # get the heights of the bars as a year x country array
+    heights = df_renew.to_numpy()
+    n_years, n_countries = heights.shape
 
-    # add the title and legends
-    plt.title("Renewable energy consumption by country",
-              fontweight="bold", y=1.1)
-    plt.legend()
+    # make the figure
+    fig = new_figure()
+    ax = fig.gca()
 
-    # save the figure as png
-    plt.savefig("renew_energy_bar_chart.png")
+    # create the position of each group of bars
+    x_pos = np.arange(n_countries)
 
-    # show the plot
-    plt.show()
+    # find the offset of each year inside a group, centered on its tick
+    width = 0.6 / max(n_years, 1)
+    offsets = (np.arange(n_years) - (n_years - 1) / 2) * width
 
-    # end the function
-    return
+    # broadcast into the position of every bar
+    positions = offsets[:, np.newaxis] + x_pos[np.newaxis, :]
 
+    # pick a color for each year
+    if n_years <= len(BAR_COLORS):
+        colors = BAR_COLORS[:n_years]
+    else:
+        colors = list(plt.cm.viridis(np.linspace(0, 1, n_years)))
 
-# function to create multiple line charts for forest area
-def plot_forest_area_line_chart(df):
-    """ This ia a function to create a lineplot with multiple lines.
-    This function takes datafrme as an argument, and use year as x axis
-    and the total forest area as y axis and plot dashed lines for
-    each country"""
-
-    # create dataframes for countries
-    df_aus = df[df["Country Name"] == "Australia"]
-    df_brazil = df[df["Country Name"] == "Brazil"]
-    df_canada = df[df["Country Name"] == "Canada"]
-    df_china = df[df["Country Name"] == "China"]
-    df_germany = df[df["Country Name"] == "Germany"]
-    df_india = df[df["Country Name"] == "India"]
-    df_japan = df[df["Country Name"] == "Japan"]
-    df_USA = df[df["Country Name"] == "United States"]
-    df_UK = df[df["Country Name"] == "United Kingdom"]
+    # plot all the bars at once
+    ax.bar(positions.ravel(),
+           heights.ravel(),
+           width=width,
+           color=np.repeat(colors, n_countries, axis=0))
 
-    # make the figure
-    plt.figure()
-
-    # use multiple x and y for plot multiple lines
-    plt.plot(df_aus["Year"],
-             df_aus["Total"],
-             linestyle='dashed',
-             label="Australia")
-    plt.plot(df_brazil["Year"],
-             df_brazil["Total"],
-             linestyle='dashed',
-             label="Brazil")
-    plt.plot(df_canada["Year"],
-             df_canada["Total"],
-             linestyle='dashed',
-             label="Canada")
-    plt.plot(df_china["Year"],
-             df_china["Total"],
-             label="China")
-    plt.plot(df_germany["Year"],
-             df_germany["Total"],
-             linestyle='dashed',
-             label="Germany")
-    plt.plot(df_india["Year"],
-             df_india["Total"],
-             linestyle='dashed',
-             label="India")
-    plt.plot(df_japan["Year"],
-             df_japan["Total"],
-             linestyle='dashed',
-             label="Japan")
-    plt.plot(df_USA["Year"],
-             df_USA["Total"],
-             label="USA")
-    plt.plot(df_UK["Year"],
-             df_UK["Total"],
-             linestyle='dashed',
-             label="UK")
+    # create x labels from the data
+    tick_labels = [COUNTRY_LABELS.get(c, c) for c in df_renew.columns]
 
     # labeling
-    plt.xlabel("Year", labelpad=(10), fontweight="bold")
-    plt.ylabel("Forest area (%)", labelpad=(10), fontweight="bold")
-
-    # add a title and legend
-    plt.title("Total forest area by country ", fontweight="bold", y=1.1)
-    plt.legend(loc='center left',
-               bbox_to_anchor=(1, 0.5),
-               fancybox=True,
-               shadow=True)
+    ax.set_xlabel("Country", labelpad=(10), fontweight="bold")
+    ax.set_ylabel("Renewable energy consumption(% energy consump.)",
+                  fontsize=(8), labelpad=(10), fontweight="bold")
+    ax.set_xticks(x_pos)
+    ax.set_xticklabels(tick_labels, rotation=90)
 
-    plt.xticks(rotation=90)
-
-    # save the plot as png
-    plt.savefig("forest_line_chart.png")
+    # add the title and legends
+    ax.set_title("Renewable energy consumption by country",
+                 fontweight="bold", y=1.1)
+    ax.legend(handles=[Patch(color=color, label=str(year))
+                       for color, year in zip(colors, df_renew.index)])
 
-    # show the plot
-    plt.show()
+    # save the plot and show or release the figure
+    finish_figure(fig, output)
 
     # end the function
     return
 
 
-# function to create multiple line charts for CO2 emmission
-def plot_arable_land_line_chart(df):
-    """ This ia a function to create a lineplot with multiple lines.
-    This function takes datafrme as an argument, and use year as x axis
-    and the total aggri. land as y axis and plot dashed lines for
-    each country"""
-
-    # create dataframes for countries
-    df_aus = df[df["Country Name"] == "Australia"]
-    df_brazil = df[df["Country Name"] == "Brazil"]
-    df_canada = df[df["Country Name"] == "Canada"]
-    df_china = df[df["Country Name"] == "China"]
-    df_germany = df[df["Country Name"] == "Germany"]
-    df_india = df[df["Country Name"] == "India"]
-    df_japan = df[df["Country Name"] == "Japan"]
-    df_USA = df[df["Country Name"] == "United States"]
-    df_UK = df[df["Country Name"] == "United Kingdom"]
+# line styles of the forest area and arable land charts
+DASHED_COUNTRIES = {"Australia": "dashed", "Brazil": "dashed",
+                    "Canada": "dashed", "Germany": "dashed",
+                    "India": "dashed", "Japan": "dashed",
+                    "United Kingdom": "dashed"}
 
-    # make the figure
-    plt.figure()
-
-    # use multiple x and y for plot multiple lines
-    plt.plot(df_aus["Year"], df_aus["Total"],
-             linestyle='dashed', label="Australia")
-    plt.plot(df_brazil["Year"], df_brazil["Total"],
-             linestyle='dashed', label="Brazil")
-    plt.plot(df_canada["Year"], df_canada["Total"],
-             linestyle='dashed', label="Canada")
-    plt.plot(df_china["Year"], df_china["Total"], label="China")
-    plt.plot(df_germany["Year"], df_germany["Total"],
-             linestyle='dashed', label="Germany")
-    plt.plot(df_india["Year"], df_india["Total"],
-             linestyle='dashed', label="India")
-    plt.plot(df_japan["Year"], df_japan["Total"],
-             linestyle='dashed', label="Japan")
-    plt.plot(df_USA["Year"], df_USA["Total"], label="USA")
-    plt.plot(df_UK["Year"], df_UK["Total"], linestyle='dashed', label="UK")
 
-    # labeling
-    plt.xlabel("Year", labelpad=(10), fontweight="bold")
-    plt.ylabel("Arable land (%)", labelpad=(10), fontweight="bold")
+# function to create multiple line charts for forest area
+def plot_forest_area_line_chart(store, output="forest_line_chart.png"):
+    """ This ia a function to create a lineplot with multiple lines for the
+    total forest area of each country, dashed except China and USA. The plot is
+    saved into output, which is a file path or a file like object"""
+
+    # plot the countries with the line chart engine
+    plot_indicator_line_chart(store, "Forest area(%)",
+                              ["Australia", "Brazil", "Canada", "China",
+                               "Germany", "India", "Japan",
+                               "United States", "United Kingdom"],
+                              output,
+                              ylabel="Forest area (%)",
+                              title="Total forest area by country ",
+                              labels=COUNTRY_LABELS,
+                              linestyles=DASHED_COUNTRIES)
 
-    # add a title and legend
-    plt.title("Total arable land by country ", fontweight="bold", y=1.1)
-    plt.legend(loc='center left',
-               bbox_to_anchor=(1, 0.5),
-               fancybox=True,
-               shadow=True)
+    # end the function
+    return
 
-    plt.xticks(rotation=90)
 
-    # save the plot as png
-    plt.savefig("arable_line_chart.png")
+# function to create multiple line charts for arable land
+def plot_arable_land_line_chart(store, output="arable_line_chart.png"):
+    """ This ia a function to create a lineplot with multiple lines for the
+    total arable land of each country, dashed except China and USA. The plot is
+    saved into output, which is a file path or a file like object"""
 
-    # show the plot
-    plt.show()
+    # plot the countries with the line chart engine
+    plot_indicator_line_chart(store, "Arable land(%)",
+                              ["Australia", "Brazil", "Canada", "China",
+                               "Germany", "India", "Japan",
+                               "United States", "United Kingdom"],
+                              output,
+                              ylabel="Arable land (%)",
+                              title="Total arable land by country ",
+                              labels=COUNTRY_LABELS,
+                              linestyles=DASHED_COUNTRIES)
 
     # end the function
     return
 
 
-def plot_heat_map(country_name):
+@traced
+def plot_heat_map(df_climate, country_name, output="heat_map.png",
+                  correlations=None):
     """ This ia a function to create a heatmap for country specific indicators.
-    This function takes country as an argument, and use plot correlation
-    between indicators"""
+    This function takes the climate table and country as arguments, and
+    use plot correlation between indicators, taken from the correlations
+    cache when one is given. The plot is saved into output, which is a
+    file path or a file like object"""
 
-    # extract the given country data
-    df_data = extract_country_data(country_name)
+    # get the correlation matrix from the cache or compute it
+    if correlations is None:
+        correlations = CorrelationCache(maxsize=1)
+    corr_matrix = correlations.get(df_climate, country_name)
 
-    # create correlation matrix
-    corr_matrix = df_data.corr()
+    # make the figure
+    fig = new_figure()
 
     # plot heatmap
     sns.heatmap(corr_matrix, cmap='coolwarm', annot=True)
@@ -569,26 +2872,29 @@ def plot_heat_map(country_name):
     plt.xlabel("")
     plt.ylabel("")
 
-    # save the plot as png
-    plt.savefig("heat_map.png")
-
-    # show the plot
-    plt.show()
+    # save the plot and show or release the figure
+    finish_figure(fig, output)
 
     # end the function
     return
 
 
-def plot_heat_map2(country_name):
+@traced
+def plot_heat_map2(df_climate, country_name, output="heat_map2.png",
+                   correlations=None):
     """ This ia a function to create a heatmap for country specific indicators.
-    This function takes country as an argument, and use plot correlation
-    between indicators"""
+    This function takes the climate table and country as arguments, and
+    use plot correlation between indicators, taken from the correlations
+    cache when one is given. The plot is saved into output, which is a
+    file path or a file like object"""
 
-    # extract the given country data
-    df_data = extract_country_data(country_name)
+    # get the correlation matrix from the cache or compute it
+    if correlations is None:
+        correlations = CorrelationCache(maxsize=1)
+    corr_matrix = correlations.get(df_climate, country_name)
 
-    # create correlation matrix
-    corr_matrix = df_data.corr()
+    # make the figure
+    fig = new_figure()
 
     # plot heatmap
     sns.heatmap(corr_matrix, cmap='YlGnBu', annot=True)
@@ -603,11 +2909,318 @@ def plot_heat_map2(country_name):
     plt.xlabel("")
     plt.ylabel("")
 
-    # save the plot as png
-    plt.savefig("heat_map2.png")
+    # save the plot and show or release the figure
+    finish_figure(fig, output)
+
+    # end the function
+    return
+
 
-    # show the plot
-    plt.show()
+# class to give lazy access to the climate data and the analysis functions
+class ClimateDataset:
+    """
+    This class gives access to the climate data of a World Bank file and
+    the analysis functions as methods. The file is read on the first access
+    of the data, so creating the object does not read anything.
+    """
+
+    def __init__(self, filename="Climate.csv", cache_dir=CACHE_DIR,
+                 catalog_file=CATALOG_FILE, fill=None):
+        """
+        This function get the file name, the cache folder, the indicator
+        catalog file and the gap filling (see read_climate_data) as
+        arguments and keep them for the first access of the data
+        """
+
+        # keep the file details
+        self.filename = filename
+        self.cache_dir = cache_dir
+        self.catalog_file = catalog_file
+        self.fill = fill
+
+        # the catalog is read on the first access
+        self._catalog = None
+
+        # the correlation matrices shared by all consumers
+        self.correlations = CorrelationCache()
+
+        # the dataframes are created on the first access
+        self._table = None
+        self._df_year_new = None
+        self._store = None
+        self._moments = None
+        self._trends = None
+        self._similarity = None
+
+    @property
+    def catalog(self):
+        """ The catalog of the indicators """
+
+        # read the catalog only on the first access
+        if self._catalog is None:
+            self._catalog = load_indicator_catalog(self.catalog_file)
+        return self._catalog
+
+    @property
+    def table(self):
+        """ The climate table with one row per country, indicator and year """
+
+        # read the file only on the first access
+        if self._table is None:
+            self._table = read_climate_data(self.filename,
+                                            cache_dir=self.cache_dir,
+                                            catalog=self.catalog,
+                                            fill=self.fill)
+        return self._table
+
+    @property
+    def df_year_new(self):
+        """ The complete series of the climate table with one year column """
+
+        # select the complete series only on the first access
+        if self._df_year_new is None:
+            self._df_year_new = compact_climate_data(self.table)
+        return self._df_year_new
+
+    @property
+    def store(self):
+        """ The store indexed by country, indicator and year """
+
+        # build the store only on the first access
+        if self._store is None:
+            self._store = ClimateStore(self.df_year_new)
+        return self._store
+
+    @property
+    def similarity(self):
+        """ The similarity index of the countries """
+
+        # build the index only on the first access
+        if self._similarity is None:
+            self._similarity = SimilarityIndex(self.store)
+        return self._similarity
+
+    def similar_countries(self, country_name, k=5):
+        """ Return the k countries with the most similar trajectories """
+
+        return self.similarity.query(country_name, k)
+
+    def extract_country_data(self, country_name):
+        """ Return the dataframe with data of given country """
+
+        return extract_country_data(self.table, country_name)
+
+    def individual_country_statisctic(self, country_name):
+        """ Return the statistics of each indicator for given country """
+
+        return individual_country_statisctic(self.table, country_name)
+
+    def individual_indicator_statistics(self, indicator_name,
+                                        countries=STATISTICS_COUNTRIES):
+        """ Return the statistics of each country for given indicator """
+
+        return individual_indicator_statistics(self.store, indicator_name,
+                                               countries)
+
+    def summary_moments(self):
+        """ Return the moments of every country and indicator """
+
+        # compute the moments only on the first call
+        if self._moments is None:
+            self._moments = summary_moments(self.table)
+        return self._moments
+
+    def trend_statistics(self):
+        """ Return the trends of every country and indicator """
+
+        # compute the trends only on the first call
+        if self._trends is None:
+            self._trends = trend_statistics(self.table)
+        return self._trends
+
+    def refresh(self, filename=None):
+        """
+        This function reads a new version of the data, by default the
+        replaced file of the dataset, and diffs it against the data in
+        memory or the latest cached table. Reading and diffing the new
+        data takes one pass over the table; after that, the moments and the
+        trends are recomputed only for the affected countries, on the 3-D
+        view of the new table, and the store and the other derived
+        dataframes are rebuilt on their next access.
+        It returns the changed cells with the affected countries and
+        indicators, so the caller can redo only their reports and charts.
+        """
+
+        # keep the previous data before the cache is replaced
+        if self._table is not None:
+            df_old = self._table
+        else:
+            df_old = read_previous_climate_cache(self.filename,
+                                                 self.cache_dir, self.fill)
+
+        # copy the previous data out of its cache file, which is removed
+        # as stale while the new data is read, and Windows cannot remove
+        # a file which is still memory mapped
+        if df_old is not None:
+            df_old = df_old.copy(deep=True)
+        self._table = None
+
+        # read the new version of the data
+        if filename is not None:
+            self.filename = filename
+        df_new = read_climate_data(self.filename, cache_dir=self.cache_dir,
+                                   catalog=self.catalog, fill=self.fill)
+
+        # find the changed cells, everything is new without previous data
+        if df_old is None:
+            df_delta = df_new.assign(Previous=np.nan)
+        else:
+            df_delta = diff_climate_tables(df_old, df_new)
+
+        # find the affected countries and indicators
+        countries = list(pd.unique(df_delta["Country Name"].astype(str)))
+        indicators = list(pd.unique(df_delta["Indicator Name"].astype(str)))
+
+        # apply the new data and drop the dataframes derived from it
+        self._table = df_new
+        self.correlations.invalidate(countries)
+        self._df_year_new = None
+        self._store = None
+        self._similarity = None
+
+        # recompute the moments and trends of the affected countries only
+        if self._moments is not None and countries:
+            self._moments = self._replace_countries(
+                self._moments, summary_moments(self.table, countries),
+                countries)
+        if self._trends is not None and countries:
+            self._trends = self._replace_countries(
+                self._trends, trend_statistics(self.table, countries),
+                countries)
+
+        # return the changes
+        return {"cells": df_delta,
+                "countries": countries,
+                "indicators": indicators}
+
+    def _replace_countries(self, df_rows, df_changed, countries):
+        """
+        Return the rows of a dataframe indexed by country and indicator
+        with the rows of the given countries replaced by the changed ones
+        """
+
+        # replace the rows of the countries
+        df_rows = pd.concat([df_rows.drop(countries, level="Country Name",
+                                          errors="ignore"), df_changed])
+
+        # keep the rows in the order of the table
+        order = pd.MultiIndex.from_product(
+            [self.table["Country Name"].cat.categories,
+             self.table["Indicator Name"].cat.categories])
+        return df_rows.loc[order[order.isin(df_rows.index)]]
+
+    def correlation_matrix(self, country_name, indicators=None, years=None,
+                           method="pearson"):
+        """ Return the cached correlation matrix of given country """
+
+        return self.correlations.get(self.table, country_name, indicators,
+                                     years, method)
+
+    def all_country_correlations(self, method="pearson"):
+        """ Return the correlation matrices of all countries """
+
+        return all_country_correlations(self.table, method)
+
+    def correlation_per_year(self, country_name):
+        """ Return the correlation over time for given country """
+
+        return correlation_per_year(self.store, country_name)
+
+    def rolling_correlation_frame(self, countries=None, window_size=5):
+        """ Return the rolling correlations of many countries """
+
+        return rolling_correlation_frame(self.store, countries,
+                                         window_size=window_size)
+
+    def country_reports(self, countries, max_workers=None,
+                        executor="process", heat_map_dir=None):
+        """ Create the reports of many countries in parallel """
+
+        return country_reports(self.table, countries,
+                               max_workers=max_workers,
+                               executor=executor,
+                               heat_map_dir=heat_map_dir,
+                               correlations=self.correlations)
+
+    def plot_heat_map(self, country_name, output="heat_map.png"):
+        """ Plot the correlation heatmap for given country """
+
+        return plot_heat_map(self.table, country_name, output,
+                             self.correlations)
+
+    def plot_heat_map2(self, country_name, output="heat_map2.png"):
+        """ Plot the second correlation heatmap for given country """
+
+        return plot_heat_map2(self.table, country_name, output,
+                              self.correlations)
+
+
+# function to plot the charts of the report
+def render_charts(store, countries, indicators=None):
+    """
+    This function plots the charts of the report for the given countries.
+    When a list of indicators is given, only the charts of those
+    indicators are plotted.
+    """
+
+    # charts of each indicator
+    charts = {"CO2 emissions(mt)": plt_co2_emission_line_chart,
+              "Urban population": plot_urban_pop_line_chart,
+              "Renew. energy consump(%)":
+                  lambda store: plot_renew_energy_bar_graph(store, countries),
+              "Forest area(%)": plot_forest_area_line_chart,
+              "Arable land(%)": plot_arable_land_line_chart}
+
+    # plot the selected charts
+    for indicator, chart in charts.items():
+        if indicators is None or indicator in indicators:
+            chart(store)
+
+    # end the function
+    return
+
+
+# function to update the report with a new version of the data
+def update_report(dataset, filename):
+    """
+    This function applies a new version of the data to the dataset and
+    prints and plots again only the statistics and charts of the affected
+    countries and indicators
+    """
+
+    # apply the changed cells
+    changes = dataset.refresh(filename)
+
+    # stop when nothing changed
+    print("Changed cells:", len(changes["cells"]))
+    if not len(changes["cells"]):
+        return
+
+    # print the moments of the affected countries only
+    print(summary_moments(dataset.table, changes["countries"]))
+
+    # create the reports of the affected countries
+    reports = dataset.country_reports(changes["countries"],
+                                      heat_map_dir="heat_maps")
+    for c, report in reports.items():
+        print("Correlation matrix for indicators in",
+              c, ":", "\n", "\n", report["correlation"], "\n")
+
+    # plot the charts of the affected indicators
+    countries = ["Australia", "Brazil", "Canada", "China", "Germany",
+                 "India", "Japan", "United Kingdom", "United States"]
+    if set(changes["countries"]) & set(countries):
+        render_charts(dataset.store, countries, changes["indicators"])
 
     # end the function
     return
@@ -619,166 +3232,194 @@ def plot_heat_map2(country_name):
 # =============================================================================
 
 
-# call the function for read file and generate 2 dataframes
-df_year, df_country = read_climate_data("Climate.csv")
-
-# call the function to extract stat properties of each indicator per state
-individual_country_statisctic("Brazil")
-individual_country_statisctic("Germany")
-individual_country_statisctic("United States")
-
-# call the function to extract stat properties of each country per indicator
-individual_indicator_statistics("Urban population")
-individual_indicator_statistics("Forest area(%)")
-individual_indicator_statistics("CO2 emissions(mt)")
-individual_indicator_statistics("Arable land(%)")
-individual_indicator_statistics("Renew. energy consump(%)")
-
-# extrcact useful countries
-df_Brazil = extract_country_data("Brazil")
-df_Germany = extract_country_data("Germany")
-df_USA = extract_country_data("United States")
-
-# assign the columns into new dataframe
-df_bcols = df_Brazil.columns
-df_gcols = df_Germany.columns
-df_ucols = df_USA.columns
-
-# find the skewness, round it to 2 decimals and put it into dictionary
-brazil_skew = df_Brazil.apply(skew).round(2).to_dict()
-Germany_skew = df_Germany.apply(skew).round(2).to_dict()
-USA_skew = df_USA.apply(skew).round(2).to_dict()
-
-# find the kutosis, round it to 2 decimals and put it into dictionary
-brazil_kurtosis = df_Brazil.apply(kurtosis).round(2).to_dict()
-Germany_kurtosis = df_Germany.apply(kurtosis).round(2).to_dict()
-USA_kurtosis = df_USA.apply(kurtosis).round(2).to_dict()
-
-# ignore warning
-warnings.filterwarnings("ignore", message="Precision loss occurred in moment\
-                        calculation due to catastrophic cancellation")
-
-# create dictionary to store summary statistics
-stats = {
-    ("Variance", "Brazil"): {
-        c: round(np.var(df_Brazil[c]), 2) for c in df_bcols
-    },
-    ("Variance", "Germany"): {
-        c: round(np.var(df_Germany[c]), 2) for c in df_gcols
-    },
-    ("Variance", "USA"): {
-        c: round(np.var(df_USA[c]), 2) for c in df_ucols
-    },
-    ("Skewness", "Brazil"): brazil_skew,
-    ("Skewness", "Germany"): Germany_skew,
-    ("Skewness", "USA"): USA_skew,
-    ("Kutosis", "Brazil"): brazil_kurtosis,
-    ("Kutosis", "Germany"): Germany_kurtosis,
-    ("Kutosis", "USA"): USA_kurtosis
-}
-
-# assign statistics into a dataframe
-df_statistics = pd.DataFrame(stats)
-
-# print the summary statistics
-print(df_statistics)
-
-# create a df with usufull countries
-df_countries = ["Brazil", "China", "Germany", "India", "United States"]
-
-# create a loop to iterate over countries df
-for c in df_countries:
-
-    # extract the country data
-    df_country1 = extract_country_data(c)
-
-    # calculate the correlation
-    df_corr = df_country1.corr()
-
-    # print all correlation matrices
-    print("Correlation matrix for indicators in",
-          c, ":", "\n", "\n", df_corr, "\n")
-
-# transform the df_year dataframe seperate years columns into one year column
-df_year_new = pd.melt(df_year,
-                      id_vars=["Country Name",
-                               "Country Code",
-                               "Indicator Name"
-                               ],
-                      value_vars=df_year.iloc[:, 3:-1].columns,
-                      var_name="Year",
-                      value_name=("Total"))
-
-# explore the new dataframe
-print(df_year_new.head())
-
-# create a list of countrues for further analysis
-countries = ["Australia", "Brazil", "Canada", "China",
-             "Germany", "India", "Japan", "United Kingdom", "United States"]
-
-# crete new dataframe with reuqired country data
-df_countries = df_year_new.groupby(
-    'Country Name').filter(lambda x: x.name in countries)
-
-# extract data for co2 emission
-df_countries_co2 = df_countries[df_countries["Indicator Name"]
-                                == "CO2 emissions(mt)"]
-
-# explore new dataframe
-print(df_countries_co2.head())
-
-# extract data for population growth
-df_countries_urb_pop = df_countries[
-    df_countries["Indicator Name"] == "Urban population"
-]
-
-# change some country names into aabbreviations
-df_countries_urb_pop.loc[df_countries_urb_pop["Country Name"]
-                         == "United States", "Country Name"] = "USA"
-df_countries_urb_pop.loc[df_countries_urb_pop["Country Name"]
-                         == "United Kingdom", "Country Name"] = "UK"
-
-
-# explore new dataframe
-print(df_countries_urb_pop.head())
-
-# extrace data for renew. energy comsump.
-df_countries_renew_energy = df_countries[
-    df_countries['Indicator Name'] == "Renew. energy consump(%)"
-].sort_values(by="Country Name", ascending=True)
-
-# explore new dataframe
-print(df_countries_renew_energy.head())
-
-# extrace data for forest area
-df_countries_forest = df_countries[df_countries["Indicator Name"]
-                                   == "Forest area(%)"]
-
-# explore new dataframe
-print(df_countries_forest.head())
-
-# extrace data for aggricultural land
-df_countries_arable = df_countries[df_countries["Indicator Name"] ==
-                                   "Arable land(%)"]
-
-# explore new dataframe
-print(df_countries_arable)
+# function to report a file too large for memory
+def aggregate_report(filename, catalog):
+    """
+    This function reads a large file chunk by chunk and prints the moments
+    of every country and indicator and the correlations of the indicators
+    of every country, without keeping the rows of the file
+    """
+
+    # build the aggregates of the file
+    aggregates = aggregate_climate_data(filename, catalog=catalog,
+                                        all_indicators=True)
+
+    # print the moments and the correlations
+    print(aggregates.moments())
+    print(aggregates.correlations())
+
+    # end the function
+    return
+
+
+# function to run the full report
+def full_report(dataset):
+    """
+    This function runs the full report: it prints the statistics of the
+    selected countries and indicators and plots all the charts
+    """
+
+    # call the function to extract stat properties of each indicator per
+    # state
+    for c in ["Brazil", "Germany", "United States"]:
+        print(format_country_statistics(
+            dataset.individual_country_statisctic(c), c))
+
+    # call the function to extract stat properties of each country per
+    # indicator
+    for i in ["Urban population", "Forest area(%)", "CO2 emissions(mt)",
+              "Arable land(%)", "Renew. energy consump(%)"]:
+        print(format_indicator_statistics(
+            dataset.individual_indicator_statistics(i), i))
+
+    # find the moments of all countries and indicators
+    df_moments = dataset.summary_moments()
 
-# call function to create CO2 emission multiple line chart
-plt_co2_emission_line_chart(df_countries_co2)
+    # select the useful countries and their labels
+    selected = {"Brazil": "Brazil", "Germany": "Germany",
+                "United States": "USA"}
+    df_selected = df_moments.loc[list(selected)].rename(index=selected,
+                                                        level=0)
 
-# call function to create population growth boxplots
-plot_urban_pop_line_chart(df_countries_urb_pop)
+    # put the statistics of each country into columns, keeping the order
+    # of the indicators
+    labels = {"Variance": "Variance", "Skewness": "Skewness",
+              "Kurtosis": "Kutosis"}
+    df_statistics = pd.DataFrame({
+        (label, country): df_selected.loc[country, column].round(2)
+        for column, label in labels.items()
+        for country in selected.values()})
+    df_statistics.index.name = None
 
-# call function to create renew. energy consumption bar charts
-plot_renew_energy_bar_graph(df_countries_renew_energy)
+    # print the summary statistics
+    print(df_statistics)
 
-# call function to create forest area multiple line charts
-plot_forest_area_line_chart(df_countries_forest)
+    # create a df with usufull countries
+    df_countries = ["Brazil", "China", "Germany", "India", "United States"]
+
+    # create the reports of the countries in parallel
+    reports = dataset.country_reports(df_countries)
+
+    # create a loop to iterate over countries df
+    for c in df_countries:
+
+        # print all correlation matrices
+        print("Correlation matrix for indicators in",
+              c, ":", "\n", "\n", reports[c]["correlation"], "\n")
+
+    # get the complete series with one year column
+    df_year_new = dataset.df_year_new
+
+    # explore the new dataframe
+    print(df_year_new.head())
+
+    # create a list of countrues for further analysis
+    countries = ["Australia", "Brazil", "Canada", "China", "Germany",
+                 "India", "Japan", "United Kingdom", "United States"]
+
+    # crete new dataframe with reuqired country data
+    df_countries = select_countries(df_year_new, countries)
+
+    # explore new dataframe
+    print(df_countries.head())
+
+    # get the store indexed by country, indicator and year
+    store = dataset.store
+
+    # explore the data for co2 emission
+    print(store.rows("CO2 emissions(mt)", countries).head())
+
+    # explore the data for population growth
+    print(store.rows("Urban population", countries).head())
+
+    # explore the data for renew. energy comsump.
+    print(store.rows("Renew. energy consump(%)", countries).head())
+
+    # explore the data for forest area
+    print(store.rows("Forest area(%)", countries).head())
+
+    # explore the data for aggricultural land
+    print(store.rows("Arable land(%)", countries))
+
+    # call function to create the line and bar charts
+    render_charts(store, countries)
+
+    # call the function to create correlation heatmap for china and USA
+    dataset.plot_heat_map("China")
+    dataset.plot_heat_map2("United States")
+
+    # end the function
+    return
+
+
+def main(argv=None):
+    """
+    This function reads the command line options and runs the full
+    report or the update of the report
+    """
+
+    # read the command line options
+    parser = argparse.ArgumentParser(description="Climate data report")
+    parser.add_argument("--headless", action="store_true",
+                        help="save the charts without showing them")
+    parser.add_argument("--update", nargs="?", const="Climate.csv",
+                        metavar="FILE",
+                        help="apply a new version of the data and redo "
+                             "only the affected statistics and charts")
+    parser.add_argument("--catalog", default=CATALOG_FILE, metavar="FILE",
+                        help="json catalog of the indicators to analyse")
+    parser.add_argument("--fill-gaps", type=int, metavar="YEARS",
+                        help="fill the gaps of at most YEARS missing years "
+                             "before the statistics")
+    parser.add_argument("--fill-method", default="linear",
+                        choices=["linear", "forward"],
+                        help="interpolate the gaps linearly or repeat the "
+                             "last value")
+    parser.add_argument("--aggregate", metavar="FILE",
+                        help="print the moments and correlations of a "
+                             "file too large for memory, read chunk by "
+                             "chunk")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="record the time and memory of each stage "
+                             "as json lines, or as a Chrome trace for a "
+                             ".json file")
+    args = parser.parse_args(argv)
+
+    # render the charts without a display when asked
+    if args.headless:
+        use_headless_backend()
+
+    # fill the gaps of the series when asked
+    fill = None
+    if args.fill_gaps is not None:
+        fill = (args.fill_method, args.fill_gaps)
+
+    # create the dataset, the file is read on the first access
+    dataset = ClimateDataset("Climate.csv", catalog_file=args.catalog,
+                             fill=fill)
+
+    # record the stages of the run when asked
+    if args.trace:
+        start_trace(args.trace)
+
+    # aggregate a large file, redo only what changed when updating, or
+    # run the full report
+    try:
+        if args.aggregate is not None:
+            aggregate_report(args.aggregate, dataset.catalog)
+        elif args.update is not None:
+            update_report(dataset, args.update)
+        else:
+            full_report(dataset)
+
+    # write the trace even when the run fails
+    finally:
+        if args.trace:
+            stop_trace()
+
+    # end the function
+    return
 
-# call function to create forest area multiple line charts
-plot_arable_land_line_chart(df_countries_arable)
 
-# call the function to create correlation heatmap for china and USA
-plot_heat_map("China")
-plot_heat_map2("United States")
+if __name__ == "__main__":
+    main()
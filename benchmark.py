@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the load, reshape, statistics and plot stages of
+ADS2_solution on synthetic World Bank shaped data.
+
+Run with:
+
+    python benchmark.py --countries 50 250 --indicators 5 20 --repeat 3
+
+Each timed stage is appended as one json line to the output file, together
+with the commit, the data size, the wall time and the peak memory, so the
+results of different commits can be compared.
+"""
+
+# import libraries
+import argparse
+import contextlib
+import csv
+import io
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import ADS2_solution as ads
+
+
+# file the results are appended to
+RESULTS_FILE = "bench_results.jsonl"
+
+# first year of the synthetic files, like the World Bank exports
+FIRST_FILE_YEAR = 1960
+
+# names of the first synthetic countries, used by the report functions
+REPORT_COUNTRIES = ["Brazil", "China", "Germany", "India", "United States"]
+
+
+# function to list the indicator codes of a synthetic file
+def synthetic_codes(n_indicators):
+    """
+    This function returns the codes of the synthetic indicators, the
+    catalog indicators first and fillers after them
+    """
+
+    # use the catalog indicators first and fillers after them
+    codes = list(ads.load_indicator_catalog())[:n_indicators]
+    return codes + ["FILLER.{}".format(n)
+                    for n in range(n_indicators - len(codes))]
+
+
+# function to write the catalog of a synthetic file
+def write_synthetic_catalog(filename, n_indicators, n_years):
+    """
+    This function writes an indicator catalog covering every indicator and
+    year of a synthetic file, so no stage drops the fillers or the years
+    outside the default catalog, and returns the catalog
+    """
+
+    # keep the name and unit of the catalog indicators, the code otherwise
+    default = ads.load_indicator_catalog()
+    catalog = {code: {"name": default.get(code, {}).get("name", code),
+                      "unit": default.get(code, {}).get("unit", ""),
+                      "first_year": FIRST_FILE_YEAR,
+                      "last_year": FIRST_FILE_YEAR + n_years - 1}
+               for code in synthetic_codes(n_indicators)}
+
+    # write the catalog and read it back like the default one
+    with open(filename, "w") as catalog_file:
+        json.dump(catalog, catalog_file, indent=4)
+    return ads.load_indicator_catalog(filename)
+
+
+# function to write a synthetic World Bank file
+def write_synthetic_csv(filename, n_countries, n_indicators, n_years,
+                        seed=0):
+    """
+    This function writes a csv file shaped like a World Bank export: four
+    header lines, one row per country and indicator and one column per
+    year. The catalog indicators come first, the other indicators are
+    fillers the reader has to skip. About one series in ten has a missing
+    year, except for the report countries which have complete series.
+    """
+
+    # use the catalog indicators first and fillers after them
+    rng = np.random.default_rng(seed)
+    catalog = ads.load_indicator_catalog()
+    codes = synthetic_codes(n_indicators)
+
+    # name the countries, the report countries first
+    names = REPORT_COUNTRIES + ["Country {:04d}".format(c)
+                                for c in range(len(REPORT_COUNTRIES),
+                                               n_countries)]
+
+    # create the year columns
+    years = [str(FIRST_FILE_YEAR + n) for n in range(n_years)]
+
+    # write the file
+    with open(filename, "w", newline="") as csv_file:
+
+        # write the header lines of the World Bank files
+        csv_file.write('"Data Source","World Development Indicators",\n\n')
+        csv_file.write('"Last Updated Date","2023-03-01",\n\n')
+
+        # write the column names and the rows
+        writer = csv.writer(csv_file, quoting=csv.QUOTE_ALL,
+                            lineterminator=",\n")
+        writer.writerow(["Country Name", "Country Code", "Indicator Name",
+                         "Indicator Code"] + years)
+        for c, country in enumerate(names[:n_countries]):
+
+            # create a random walk for every indicator of the country
+            values = 50 + rng.normal(0, 1, (len(codes), n_years)).cumsum(1)
+
+            # leave a gap in some of the series
+            gaps = ((rng.random(len(codes)) < 0.1) &
+                    (country not in REPORT_COUNTRIES))
+            values[gaps, rng.integers(0, n_years, gaps.sum())] = np.nan
+
+            # write one row per indicator
+            for code, row in zip(codes, values):
+                name = catalog.get(code, {}).get("name", code)
+                writer.writerow([country, "C{:04d}".format(c), name, code] +
+                                ["" if np.isnan(v) else "{:.4f}".format(v)
+                                 for v in row])
+
+
+# function to measure one stage
+def measure(function, *args, **kwargs):
+    """
+    This function calls a function twice and returns its result, the wall
+    time and cpu time in seconds of the first call and the peak memory
+    allocated during the second call in bytes. The memory is traced in a
+    separate call since tracemalloc slows down the allocations.
+    """
+
+    # run the stage without printing its output
+    with contextlib.redirect_stdout(io.StringIO()):
+
+        # time the first call
+        wall, cpu = time.perf_counter(), time.process_time()
+        result = function(*args, **kwargs)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+        # trace the memory of the second call
+        tracemalloc.start()
+        function(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    # return the result and the measures
+    return result, wall, cpu, peak
+
+
+# function to get the current commit
+def current_commit():
+    """
+    This function returns the hash of the current git commit of the
+    benchmarked code, or None outside a git repository
+    """
+
+    # ask git for the commit of the folder of this file
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# function to run every stage on one synthetic file
+def run_stages(filename, cache_dir, catalog):
+    """
+    This function runs the pipeline stages one after the other on the
+    given file, read with the given catalog, and yields the name, wall
+    time, cpu time and peak memory of each stage
+    """
+
+    # function to parse the csv file into a new cache folder on each call
+    folders = []
+
+    def parse_csv():
+        """ Parse the csv file, writing its cache into a new folder """
+        folders.append(tempfile.mkdtemp(dir=cache_dir))
+        return ads.read_climate_data(filename, cache_dir=folders[-1],
+                                     catalog=catalog)
+
+    # parse the csv file
+    os.makedirs(cache_dir, exist_ok=True)
+    table, *measures = measure(parse_csv)
+    yield ("read_csv",) + tuple(measures)
+
+    # read the table again from the cache
+    _, *measures = measure(ads.read_climate_data, filename,
+                           cache_dir=folders[-1], catalog=catalog)
+    yield ("read_cache",) + tuple(measures)
+
+    # extract the data of every country
+    countries = list(table["Country Name"].cat.categories)
+    _, *measures = measure(lambda: [ads.extract_country_data(table, c)
+                                    for c in countries])
+    yield ("extract_country_data",) + tuple(measures)
+
+    # build the compact long dataframe and the store
+    df_year_new, *measures = measure(ads.compact_climate_data, table)
+    yield ("compact_climate_data",) + tuple(measures)
+    store, *measures = measure(ads.ClimateStore, df_year_new)
+    yield ("climate_store",) + tuple(measures)
+
+    # compute the statistics
+    indicators = list(table["Indicator Name"].cat.categories)
+    _, *measures = measure(lambda: [ads.individual_indicator_statistics(
+        store, i) for i in indicators])
+    yield ("individual_indicator_statistics",) + tuple(measures)
+    _, *measures = measure(ads.summary_moments, table)
+    yield ("summary_moments",) + tuple(measures)
+    _, *measures = measure(ads.rolling_correlation_frame, store)
+    yield ("rolling_correlation_frame",) + tuple(measures)
+    _, *measures = measure(ads.all_country_correlations, table)
+    yield ("all_country_correlations",) + tuple(measures)
+
+    # render the charts into memory
+    _, *measures = measure(ads.render_to_buffer,
+                           ads.plot_indicator_line_chart, store,
+                           indicators[0], countries[:50],
+                           ylabel="", title="")
+    yield ("plot_indicator_line_chart",) + tuple(measures)
+    _, *measures = measure(ads.render_to_buffer,
+                           ads.plot_heat_map, table, REPORT_COUNTRIES[0])
+    yield ("plot_heat_map",) + tuple(measures)
+
+
+# function to run the benchmarks
+def main(argv=None):
+    """
+    This function runs the benchmarks for every requested data size and
+    appends the results to the output file as json lines
+    """
+
+    # read the command line options
+    parser = argparse.ArgumentParser(description="Pipeline benchmarks")
+    parser.add_argument("--countries", type=int, nargs="+", default=[50])
+    parser.add_argument("--indicators", type=int, nargs="+", default=[5])
+    parser.add_argument("--years", type=int, nargs="+", default=[62])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=RESULTS_FILE)
+    args = parser.parse_args(argv)
+
+    # render the charts without a display
+    ads.use_headless_backend()
+
+    # describe the run
+    run = {"commit": current_commit(),
+           "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+           "python": platform.python_version(),
+           "machine": platform.machine()}
+
+    # run every size in a temporary folder
+    with tempfile.TemporaryDirectory() as folder, \
+            open(args.output, "a") as output:
+        for n_countries in args.countries:
+            for n_indicators in args.indicators:
+                for n_years in args.years:
+
+                    # write the synthetic file and its catalog
+                    filename = os.path.join(folder, "Climate.csv")
+                    write_synthetic_csv(filename, n_countries,
+                                        n_indicators, n_years)
+                    catalog = write_synthetic_catalog(
+                        os.path.join(folder, "indicators.json"),
+                        n_indicators, n_years)
+                    size = {"countries": n_countries,
+                            "indicators": n_indicators,
+                            "years": n_years,
+                            "file_bytes": os.path.getsize(filename)}
+
+                    # run the stages, with a new cache each time
+                    for repeat in range(args.repeat):
+                        cache_dir = os.path.join(folder,
+                                                 "cache{}".format(repeat))
+                        for stage, wall, cpu, peak in run_stages(
+                                filename, cache_dir, catalog):
+                            record = dict(run, **size, stage=stage,
+                                          repeat=repeat,
+                                          wall_seconds=round(wall, 6),
+                                          cpu_seconds=round(cpu, 6),
+                                          peak_bytes=peak)
+                            output.write(json.dumps(record) + "\n")
+                            print("{:>34} {:>9.4f}s {:>12,d} B".format(
+                                stage, wall, peak))
+
+    # end the function
+    return
+
+
+if __name__ == "__main__":
+    main()
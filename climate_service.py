@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+"""
+Local query service for the climate data of ADS2_solution.
+
+Run with:
+
+    python climate_service.py --port 8765
+
+The cleaned dataset is read once and kept in memory. Slices, summary
+statistics, moments and correlations are returned as json and charts as
+png, for example:
+
+    http://127.0.0.1:8765/stats/country?name=Brazil
+    http://127.0.0.1:8765/chart/line.png?indicator=Forest%20area(%25)
+
+The service only binds to the local host. Requests are handled
+concurrently by one asyncio loop, the results are cached, the queries are
+computed on a pool of threads and the charts are rendered by a pool of
+worker processes, so slow queries and renders do not block the loop.
+"""
+
+# import libraries
+import argparse
+import asyncio
+import json
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+import ADS2_solution as ads
+
+
+# address the service binds to
+HOST = "127.0.0.1"
+
+# default port of the service
+PORT = 8765
+
+# number of results kept in memory
+RESULT_CACHE_SIZE = 512
+
+# countries of the line charts when none are given
+CHART_COUNTRIES = ["Australia", "Brazil", "Canada", "China", "Germany",
+                   "India", "Japan", "United Kingdom", "United States"]
+
+# dataset of each worker process
+_worker_dataset = None
+
+
+# class to report a bad request with its http status
+class QueryError(Exception):
+    """
+    This class is the error of a query which cannot be answered, with the
+    http status sent back to the client
+    """
+
+    def __init__(self, status, message):
+
+        # keep the status and the message
+        super().__init__(message)
+        self.status = status
+
+
+# function to start a chart worker
+def _start_worker(filename, cache_dir, catalog_file, fill):
+    """
+    This function runs once in each worker process and opens the dataset,
+    read from the cache written by the service, and the headless backend
+    """
+
+    # open the dataset of the worker
+    global _worker_dataset
+    ads.use_headless_backend()
+    _worker_dataset = ads.ClimateDataset(filename, cache_dir, catalog_file,
+                                         fill)
+
+    # end the function
+    return
+
+
+# function to render a chart in a worker
+def _render_chart(kind, name, countries=None):
+    """
+    This function renders a chart of the worker dataset and returns its
+    png bytes: the heat map of a country, or the line chart of an
+    indicator for the given countries
+    """
+
+    # render the heat map of the country
+    dataset = _worker_dataset
+    if kind == "heat_map":
+        return ads.render_to_buffer(ads.plot_heat_map, dataset.table, name,
+                                    correlations=dataset.correlations)
+
+    # find the unit of the indicator
+    units = {entry["name"]: entry["unit"]
+             for entry in dataset.catalog.values()}
+
+    # render the line chart of the indicator
+    return ads.render_to_buffer(ads.plot_indicator_line_chart,
+                                dataset.store, name, countries,
+                                ylabel=units.get(name, ""), title=name)
+
+
+# function to turn a dataframe into json
+def frame_json(df):
+    """
+    This function returns the json of a dataframe with its index, columns
+    and data, and null for the missing values
+    """
+    return df.to_json(orient="split", double_precision=15)
+
+
+# class to answer the queries
+class ClimateService:
+    """
+    This class answers the queries on a ClimateDataset kept in memory. The
+    answers are cached by path and query, and concurrent requests for the
+    same answer share one computation. The queries are computed on a pool
+    of threads, so the loop keeps serving the other clients meanwhile, and
+    charts are rendered in a pool of worker processes, since the headless
+    figure cannot be shared by threads.
+    """
+
+    def __init__(self, dataset, max_workers=None, max_threads=None,
+                 cache_size=RESULT_CACHE_SIZE):
+
+        # keep the dataset and build it before the first query
+        self.dataset = dataset
+        self.dataset.similarity
+
+        # keep the answers in the order of their use
+        self.cache_size = cache_size
+        self._results = OrderedDict()
+        self._pending = {}
+
+        # start the query threads and the chart workers on the cached
+        # dataset
+        self._threads = ThreadPoolExecutor(max_threads)
+        self._workers = ProcessPoolExecutor(
+            max_workers, initializer=_start_worker,
+            initargs=(dataset.filename, dataset.cache_dir,
+                      dataset.catalog_file, dataset.fill))
+
+        # the routes of the queries
+        self.routes = {"/countries": self.countries,
+                       "/indicators": self.indicators,
+                       "/slice": self.slice,
+                       "/stats/country": self.country_statistics,
+                       "/stats/indicator": self.indicator_statistics,
+                       "/moments": self.moments,
+                       "/trends": self.trends,
+                       "/correlation": self.correlation,
+                       "/similar": self.similar,
+                       "/chart/heat_map.png": self.heat_map_chart,
+                       "/chart/line.png": self.line_chart}
+
+    def close(self):
+        """ Stop the query threads and the chart workers """
+        self._threads.shutdown(cancel_futures=True)
+        self._workers.shutdown(cancel_futures=True)
+
+    def _country(self, query, key="country"):
+        """ Return the country of the query, which must be known """
+
+        # check the country
+        name = self._required(query, key)
+        if name not in self.dataset.table["Country Name"].cat.categories:
+            raise QueryError(HTTPStatus.NOT_FOUND,
+                             "unknown country: " + name)
+        return name
+
+    def _indicator(self, query, key="indicator"):
+        """ Return the indicator of the query, which must be known """
+
+        # check the indicator
+        name = self._required(query, key)
+        if name not in self.dataset.table["Indicator Name"].cat.categories:
+            raise QueryError(HTTPStatus.NOT_FOUND,
+                             "unknown indicator: " + name)
+        return name
+
+    def _required(self, query, key):
+        """ Return a parameter of the query, which must be given """
+
+        # check the parameter
+        if key not in query:
+            raise QueryError(HTTPStatus.BAD_REQUEST,
+                             "missing parameter: " + key)
+        return query[key]
+
+    def _list(self, query, key):
+        """ Return a comma separated parameter as a list, or None """
+
+        # split the parameter
+        if not query.get(key):
+            return None
+        return [value.strip() for value in query[key].split(",")]
+
+    def countries(self, query):
+        """ Return the countries of the dataset """
+        return json.dumps(list(self.dataset.table["Country Name"]
+                               .cat.categories))
+
+    def indicators(self, query):
+        """ Return the indicators of the dataset """
+        return json.dumps(list(self.dataset.table["Indicator Name"]
+                               .cat.categories))
+
+    def slice(self, query):
+        """
+        Return the rows of the climate table of the given countries,
+        indicators and first and last years, all of them by default
+        """
+
+        # select the rows of the countries and indicators
+        df_climate = self.dataset.table
+        rows = pd.Series(True, index=df_climate.index)
+        countries = self._list(query, "countries")
+        if countries is not None:
+            rows &= df_climate["Country Name"].isin(countries)
+        indicators = self._list(query, "indicators")
+        if indicators is not None:
+            rows &= df_climate["Indicator Name"].isin(indicators)
+
+        # select the rows of the years
+        try:
+            if query.get("first"):
+                rows &= df_climate["Year"] >= int(query["first"])
+            if query.get("last"):
+                rows &= df_climate["Year"] <= int(query["last"])
+        except ValueError:
+            raise QueryError(HTTPStatus.BAD_REQUEST,
+                             "the years must be integers")
+
+        # return the rows without their index
+        return frame_json(df_climate[rows].reset_index(drop=True))
+
+    def country_statistics(self, query):
+        """ Return the statistics of each indicator of a country """
+
+        # summarise the indicators of the country
+        return frame_json(self.dataset.individual_country_statisctic(
+            self._country(query, "name")))
+
+    def indicator_statistics(self, query):
+        """
+        Return the statistics of each country for an indicator, of the
+        given countries or of all countries
+        """
+
+        # summarise the countries of the indicator
+        return frame_json(self.dataset.individual_indicator_statistics(
+            self._indicator(query, "name"), self._list(query, "countries")))
+
+    def moments(self, query):
+        """ Return the moments of the given countries, or of all """
+
+        # select the moments of the countries
+        df_moments = self.dataset.summary_moments()
+        countries = self._list(query, "countries")
+        if countries is not None:
+            df_moments = df_moments[df_moments.index.get_level_values(
+                0).isin(countries)]
+        return frame_json(df_moments)
+
+    def trends(self, query):
+        """
+        Return the trends of the given countries and indicators, or of all,
+        sorted by the given column when asked
+        """
+
+        # select the trends of the countries and indicators
+        df_trends = self.dataset.trend_statistics()
+        countries = self._list(query, "countries")
+        if countries is not None:
+            df_trends = df_trends[df_trends.index.get_level_values(
+                0).isin(countries)]
+        indicators = self._list(query, "indicators")
+        if indicators is not None:
+            df_trends = df_trends[df_trends.index.get_level_values(
+                1).isin(indicators)]
+
+        # sort the trends, for example by CAGR to find the fastest decline
+        if query.get("sort"):
+            if query["sort"] not in df_trends.columns:
+                raise QueryError(HTTPStatus.BAD_REQUEST,
+                                 "unknown column: " + query["sort"])
+            df_trends = df_trends.sort_values(query["sort"])
+        return frame_json(df_trends)
+
+    def correlation(self, query):
+        """ Return the correlation matrix of the indicators of a country """
+
+        # check the method
+        method = query.get("method", "pearson")
+        if method not in ("pearson", "spearman", "kendall"):
+            raise QueryError(HTTPStatus.BAD_REQUEST,
+                             "unknown method: " + method)
+
+        # get the matrix from the correlation cache
+        return frame_json(self.dataset.correlation_matrix(
+            self._country(query), method=method))
+
+    def similar(self, query):
+        """
+        Return the k countries, 5 by default, whose trajectories are the
+        most similar to those of a country
+        """
+
+        # check the number of countries
+        try:
+            k = int(query.get("k", 5))
+        except ValueError:
+            raise QueryError(HTTPStatus.BAD_REQUEST, "k must be an integer")
+
+        # query the similarity index
+        try:
+            return frame_json(self.dataset.similar_countries(
+                self._country(query), k))
+        except KeyError as error:
+            raise QueryError(HTTPStatus.NOT_FOUND, error.args[0])
+
+    async def heat_map_chart(self, query):
+        """ Return the png of the correlation heat map of a country """
+
+        # render the chart in a worker
+        return await asyncio.get_running_loop().run_in_executor(
+            self._workers, _render_chart, "heat_map", self._country(query))
+
+    async def line_chart(self, query):
+        """
+        Return the png of the line chart of an indicator for the given
+        countries, the report countries by default
+        """
+
+        # keep the countries with the complete series of the indicator
+        indicator = self._indicator(query)
+        countries = self._list(query, "countries") or CHART_COUNTRIES
+        countries = [c for c in countries
+                     if self.dataset.store.has(c, indicator)]
+        if not countries:
+            raise QueryError(HTTPStatus.NOT_FOUND,
+                             "no complete series of " + indicator)
+
+        # render the chart in a worker
+        return await asyncio.get_running_loop().run_in_executor(
+            self._workers, _render_chart, "line", indicator, countries)
+
+    async def answer(self, path, query):
+        """
+        This function returns the answer of a query as bytes, from the
+        cache when it was already computed
+        """
+
+        # find the route of the query
+        if path not in self.routes:
+            raise QueryError(HTTPStatus.NOT_FOUND, "unknown path: " + path)
+
+        # return the cached answer and mark it as recently used
+        key = (path, tuple(sorted(query.items())))
+        if key in self._results:
+            self._results.move_to_end(key)
+            return self._results[key]
+
+        # wait for the same query when it is already running
+        if key in self._pending:
+            return await asyncio.shield(self._pending[key])
+
+        # compute the answer in a thread, or in a worker for the charts
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending[key] = future
+        try:
+            route = self.routes[path]
+            if asyncio.iscoroutinefunction(route):
+                answer = await route(query)
+            else:
+                answer = await loop.run_in_executor(self._threads, route,
+                                                    query)
+            if isinstance(answer, str):
+                answer = answer.encode()
+            future.set_result(answer)
+
+        # pass the error to the waiting requests too
+        except Exception as error:
+            future.set_exception(error)
+            future.exception()
+            raise
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        finally:
+            del self._pending[key]
+
+        # store the answer and drop the least recently used one
+        self._results[key] = answer
+        if len(self._results) > self.cache_size:
+            self._results.popitem(last=False)
+
+        # return the answer
+        return answer
+
+    async def handle_client(self, reader, writer):
+        """
+        This function reads one http request from the client, answers it
+        and closes the connection
+        """
+
+        # read the request line and skip the headers
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()).strip():
+                pass
+
+            # answer only the get requests
+            if len(request) != 3:
+                raise QueryError(HTTPStatus.BAD_REQUEST, "bad request")
+            if request[0] != "GET":
+                raise QueryError(HTTPStatus.METHOD_NOT_ALLOWED,
+                                 "only GET is supported")
+
+            # answer the query
+            url = urlsplit(request[1])
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            body = await self.answer(url.path, query)
+            status = HTTPStatus.OK
+            content_type = ("image/png" if url.path.endswith(".png")
+                            else "application/json")
+
+        # send the errors as json
+        except QueryError as error:
+            status = error.status
+            body = json.dumps({"error": str(error)}).encode()
+            content_type = "application/json"
+        except Exception as error:
+            status = HTTPStatus.INTERNAL_SERVER_ERROR
+            body = json.dumps({"error": repr(error)}).encode()
+            content_type = "application/json"
+
+        # send the response
+        writer.write("HTTP/1.1 {} {}\r\nContent-Type: {}\r\n"
+                     "Content-Length: {}\r\nConnection: close\r\n\r\n"
+                     .format(status.value, status.phrase, content_type,
+                             len(body)).encode() + body)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def start(self, port=PORT):
+        """
+        This function starts listening on the local host and returns the
+        asyncio server. Port 0 picks a free port.
+        """
+        return await asyncio.start_server(self.handle_client, HOST, port)
+
+
+# function to run the service in a background thread
+def serve_in_thread(service, port=0):
+    """
+    This function runs the service in a new thread, for example to query
+    it with a local client in the same process, and returns its url and
+    the function which stops it
+    """
+
+    # start the loop of the service in the thread
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(service.start(port))
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    # function to stop the service
+    def stop():
+        """ Stop the server, its loop and the chart workers """
+
+        # close the server in its loop and stop the loop
+        asyncio.run_coroutine_threadsafe(_close(server), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+        service.close()
+
+    # return the url and the stop function
+    host, port = server.sockets[0].getsockname()[:2]
+    return "http://{}:{}".format(host, port), stop
+
+
+# function to close a server
+async def _close(server):
+    """ Close the server and wait for it """
+
+    # close the server
+    server.close()
+    await server.wait_closed()
+
+
+# function to run the service until it is stopped
+async def serve(service, port=PORT):
+    """
+    This function runs the service on the given port until it is
+    cancelled
+    """
+
+    # answer the queries until stopped
+    server = await service.start(port)
+    print("Serving on http://{}:{}".format(
+        *server.sockets[0].getsockname()[:2]))
+    async with server:
+        await server.serve_forever()
+
+
+# function to start the service
+def main(argv=None):
+    """
+    This function reads the command line options and runs the service
+    """
+
+    # read the command line options
+    parser = argparse.ArgumentParser(description="Climate query service")
+    parser.add_argument("--file", default="Climate.csv",
+                        help="World Bank climate data file")
+    parser.add_argument("--catalog", default=ads.CATALOG_FILE,
+                        metavar="FILE",
+                        help="json catalog of the indicators to analyse")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of chart rendering processes")
+    args = parser.parse_args(argv)
+
+    # read the dataset and answer the queries until interrupted
+    service = ClimateService(ads.ClimateDataset(args.file,
+                                                catalog_file=args.catalog),
+                             max_workers=args.workers)
+    try:
+        asyncio.run(serve(service, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+    # end the function
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+"""
+Check the correlations of many countries at once against DataFrame.corr on
+series with missing years
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ADS2_solution as ads
+
+
+# function to build the series of a few countries with gaps
+def make_cube(seed=0):
+    """ This function returns rounded random walks with missing years """
+
+    # draw rounded walks, so some values are tied, and blank some years
+    rng = np.random.default_rng(seed)
+    cube = rng.normal(size=(6, 5, 30)).cumsum(axis=2).round(0)
+    cube[rng.random(cube.shape) < 0.15] = np.nan
+
+    # add a series without data and one with a single year
+    cube[0, 2] = np.nan
+    cube[1, 3, :29] = np.nan
+    return cube
+
+
+@pytest.mark.parametrize("method", ["pearson", "spearman"])
+def test_batched_correlations_match_pandas(method, monkeypatch):
+    """ The pairs are correlated over the years where both have data """
+
+    # rank the pairs in several blocks
+    monkeypatch.setattr(ads, "RANK_BLOCK_SIZE", 7)
+    cube = make_cube()
+
+    # compare every country with pandas
+    corr = ads.batched_correlations(cube, method)
+    for c in range(len(cube)):
+        expected = pd.DataFrame(cube[c].T).corr(method=method).to_numpy()
+        np.testing.assert_allclose(corr[c], expected, atol=1e-12)
@@ -0,0 +1,80 @@
+"""
+Check that the MomentAccumulator merged chunk by chunk agrees with a single
+pass over the same values
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import ADS2_solution as ads
+
+
+# function to build the values of a few series with gaps
+def make_values(n_series=3, n_values=2000, seed=0):
+    """ This function returns exponential values with some missing ones """
+
+    # draw the values and blank some of them
+    rng = np.random.default_rng(seed)
+    values = rng.exponential(size=(n_series, n_values))
+    values[rng.random(values.shape) < 0.1] = np.nan
+    return values
+
+
+@pytest.mark.parametrize("batch", [7, 100, 1000])
+def test_chunked_moments_match_single_pass(batch):
+    """ The moments do not depend on how the values are chunked """
+
+    # accumulate the values in one pass and chunk by chunk
+    values = make_values()
+    single = ads.MomentAccumulator((len(values),)).update(values)
+    chunked = ads.MomentAccumulator((len(values),))
+    for start in range(0, values.shape[1], batch):
+        chunked.merge(ads.MomentAccumulator((len(values),)).update(
+            values[:, start:start + batch]))
+
+    # compare the moments
+    for name in ["count", "mean", "m2", "m3", "m4", "minimum",
+                 "maximum"]:
+        np.testing.assert_allclose(getattr(chunked, name),
+                                   getattr(single, name), rtol=1e-9)
+
+
+@pytest.mark.parametrize("order", ["random", "sorted"])
+@pytest.mark.parametrize("batch", [10, 37, 1000])
+def test_chunked_quantiles_match_single_pass(order, batch):
+    """ The quartiles stay close to the exact ones in any order """
+
+    # accumulate the values chunk by chunk
+    values = make_values()
+    if order == "sorted":
+        values = np.sort(values, axis=1)
+    chunked = ads.MomentAccumulator((len(values),))
+    for start in range(0, values.shape[1], batch):
+        chunked.update(values[:, start:start + batch])
+
+    # compare the share of values below each quartile, the sketch being
+    # as precise in rank as the single pass
+    single = ads.MomentAccumulator((len(values),)).update(values)
+    for accumulator in [chunked, single]:
+        below = (values[:, :, None]
+                 < accumulator.quantiles()[:, None, :]).sum(axis=1)
+        ranks = below / (~np.isnan(values)).sum(axis=1, keepdims=True)
+        np.testing.assert_allclose(
+            ranks, np.tile(ads.DESCRIBE_QUANTILES, (len(values), 1)),
+            atol=0.025)
+    assert chunked.centroids.shape[-1] <= ads.SKETCH_SIZE
+
+
+def test_short_series_are_exact():
+    """ Series shorter than the sketch keep their values like describe """
+
+    # summarise short series with gaps
+    values = make_values(n_values=30)
+    df_values = pd.DataFrame(values.T)
+    accumulator = ads.MomentAccumulator((len(values),)).update(values)
+
+    # compare with pandas, the sketch being only as wide as the series
+    assert accumulator.centroids.shape[-1] <= values.shape[1]
+    np.testing.assert_allclose(ads.describe_frame(df_values).to_numpy(),
+                               df_values.describe().to_numpy())